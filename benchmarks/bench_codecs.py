@@ -0,0 +1,83 @@
+#! /usr/bin/env python3
+
+"""
+Benchmark the save_obj codecs: throughput and compression ratio
+
+Run from the top of the repository with e.g.
+    python benchmarks/bench_codecs.py --size 64 --threads 1 4
+"""
+
+import argparse
+import array
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from thtools.saving import load_obj, make_obj_dir, save_obj  # noqa: E402
+
+
+def make_objects(size_mb):
+    """Build representative objects of roughly `size_mb` MB each"""
+    n = size_mb * (1 << 20) // 8
+    rng = random.Random(0)
+    return {
+        'trajectory': array.array(
+            'd', (math.sin(i * 1e-3) + rng.gauss(0, 1e-3)
+                  for i in range(n))),
+        'results_dict': {'frame_{}'.format(i): {'energy': rng.random(),
+                                                'label': 'state_{}'.format(
+                                                    i % 7)}
+                         for i in range(n // 16)},
+        'random_bytes': os.urandom(n * 8),
+    }
+
+
+def best_of(repeat, func, *args, **kwargs):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', type=int, default=16,
+                        help='Approximate size of each object in MB')
+    parser.add_argument('--codecs', nargs='+',
+                        default=['none', 'zlib', 'lzma', 'bz2'])
+    parser.add_argument('--threads', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+    objects = make_objects(args.size)
+    print('{:<14}{:<7}{:>8}{:>12}{:>12}{:>8}'.format(
+        'object', 'codec', 'threads', 'save MB/s', 'load MB/s', 'ratio'))
+    with tempfile.TemporaryDirectory() as tmp:
+        base = os.path.join(tmp, '')
+        make_obj_dir(base)
+        for obj_name, obj in objects.items():
+            name = base + obj_name
+            raw_size = os.path.getsize(save_obj(obj, name))
+            for codec in args.codecs:
+                _codec = None if codec == 'none' else codec
+                for threads in args.threads:
+                    t_save = best_of(args.repeat, save_obj, obj, name,
+                                     codec=_codec, threads=threads)
+                    size = os.path.getsize(save_obj(obj, name, codec=_codec,
+                                                    threads=threads))
+                    t_load = best_of(args.repeat, load_obj, name,
+                                     threads=threads)
+                    mb = raw_size / float(1 << 20)
+                    print('{:<14}{:<7}{:>8}{:>12.1f}{:>12.1f}{:>8.2f}'.format(
+                        obj_name, codec, threads, mb / t_save, mb / t_load,
+                        raw_size / float(size)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#! /usr/bin/env python3
+
+"""
+Benchmark merge_dicts and LayeredDict against folding merge_two_dicts
+
+Run from the top of the repository with e.g.
+    python benchmarks/bench_dict_merge.py --layers 50 --keys 2000
+"""
+
+import argparse
+import functools
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from thtools.dict_tools import (LayeredDict, merge_dicts,  # noqa: E402
+                                merge_two_dicts)
+
+
+def make_layers(n_layers, n_keys, depth, seed=0):
+    """Config-like layers: each overrides a random subset of a nested dict"""
+    rng = random.Random(seed)
+
+    def make(level):
+        d = {}
+        for i in range(n_keys if level == 0 else 8):
+            if rng.random() < 0.3:
+                continue
+            key = 'key{}'.format(i)
+            if level < depth and rng.random() < 0.2:
+                d[key] = make(level + 1)
+            else:
+                d[key] = rng.random()
+        return d
+
+    return [make(0) for _ in range(n_layers)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--layers', type=int, default=30)
+    parser.add_argument('--keys', type=int, default=1000)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args(argv)
+    layers = make_layers(args.layers, args.keys, args.depth)
+    lookup_keys = list(set().union(*layers))[:100]
+    cases = [
+        ('merge_two_dicts fold (shallow)',
+         lambda: functools.reduce(merge_two_dicts, layers, {})),
+        ('merge_dicts deep=False', lambda: merge_dicts(*layers, deep=False)),
+        ('merge_dicts deep=True', lambda: merge_dicts(*layers)),
+        ('LayeredDict build', lambda: LayeredDict(*layers)),
+        ('LayeredDict 100 lookups',
+         lambda: [LayeredDict(*layers)[k] for k in lookup_keys]),
+        ('LayeredDict to_dict', lambda: LayeredDict(*layers).to_dict()),
+    ]
+    print('{} layers of ~{} keys, depth {}'.format(args.layers, args.keys,
+                                                   args.depth))
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=args.number, repeat=3))
+        print('{:<32}{:>10.3f} ms'.format(name, 1e3 * best / args.number))
+
+
+if __name__ == '__main__':
+    main()
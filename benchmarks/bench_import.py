@@ -0,0 +1,135 @@
+#! /usr/bin/env python3
+
+"""
+Measure the import cost of thtools with `python -X importtime`
+
+Run from the top of the repository with e.g.
+    python benchmarks/bench_import.py --check
+
+Each scenario is timed against a reference statement that imports just
+the standard library modules the scenario is expected to need, so the
+`own ms` column is the cost of thtools itself, largely independent of how
+fast the machine imports e.g. pickle.
+
+With --check, this exits with an error if a scenario imports a module it
+should not need, or if its own cost exceeds its budget (scaled by
+--budget-scale), to guard against regressions in the lazy imports. With
+--compare, it also fails if a scenario's own cost grew by more than
+--tolerance over a run saved with --output.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+# statement to time: (reference statement importing the stdlib modules it
+# needs, budget in ms for thtools' own cost, modules it must not import)
+SCENARIOS = {
+    'import thtools': (
+        'import importlib', 3.,
+        {'subprocess', 'pickle', 'asyncio', 'inspect'}),
+    'import thtools; thtools.cd': (
+        'import importlib, contextlib, contextvars', 5.,
+        {'subprocess', 'pickle', 'asyncio', 'inspect'}),
+    'import thtools; thtools.merge_dicts': (
+        'import importlib, collections.abc', 5.,
+        {'subprocess', 'pickle', 'asyncio'}),
+    'import thtools; thtools.save_obj': (
+        'import importlib, array, collections.abc, contextlib, functools, '
+        'io, itertools, mmap, pickle, queue, struct, threading, zlib, '
+        'fcntl', 8.,
+        {'asyncio', 'inspect', 'subprocess'}),
+    'import thtools; thtools.run': (
+        'import importlib, collections, contextlib, re, subprocess, '
+        'threading', 8.,
+        {'asyncio', 'pickle', 'xml.etree'}),
+}
+
+
+def import_cost(stmt):
+    """
+    Run `stmt` in a fresh interpreter
+
+    :return: Total microseconds spent importing, and the set of modules
+        imported
+    """
+    code = '{}\nimport sys\nprint(" ".join(sys.modules))'.format(stmt)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, env=env, check=True)
+    total = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        total += int(line.split('|')[0].split(':')[1])
+    return total, set(proc.stdout.split())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--check', action='store_true',
+                        help='Fail on unexpected imports or scenarios over '
+                             'their budget')
+    parser.add_argument('--budget-scale', type=float, default=1.,
+                        help='With --check, multiply the budget of each '
+                             'scenario by this, e.g. for a slow machine')
+    parser.add_argument('--output', help='Save the results as JSON')
+    parser.add_argument('--compare',
+                        help='JSON from an earlier --output run; fail if a '
+                             'scenario got slower by more than --tolerance')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='Default: 1.5. Allowed ratio to --compare, '
+                             'plus 1 ms for noise')
+    args = parser.parse_args(argv)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    failures = []
+    results = {}
+    print('{:<42}{:>10}{:>10}{:>10}'.format('scenario', 'total ms',
+                                            'own ms', 'budget'))
+    for stmt, (reference, budget, forbidden) in SCENARIOS.items():
+        # interleave the runs, so a change in machine load affects both
+        totals, references = [], []
+        modules = set()
+        for _ in range(args.repeat):
+            total, modules = import_cost(stmt)
+            totals.append(total)
+            references.append(import_cost(reference)[0])
+        total = statistics.median(totals) / 1e3
+        own = total - statistics.median(references) / 1e3
+        budget *= args.budget_scale
+        results[stmt] = {'total_ms': total, 'own_ms': own}
+        problems = []
+        unexpected = sorted(forbidden & modules)
+        if unexpected:
+            problems.append('imports {}'.format(', '.join(unexpected)))
+        if own > budget:
+            problems.append('over budget')
+        if baseline is not None and stmt in baseline:
+            limit = baseline[stmt]['own_ms'] * args.tolerance + 1.
+            if own > limit:
+                problems.append('{:.2f}x baseline'.format(
+                    own / max(baseline[stmt]['own_ms'], 1e-3)))
+        print('{:<42}{:>10.2f}{:>10.2f}{:>10.2f}{}'.format(
+            stmt, total, own, budget,
+            '  ' + '; '.join(problems) if problems else ''))
+        if problems:
+            failures.append(stmt)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if (args.check or baseline is not None) and failures:
+        sys.exit('Import regression in: {}'.format('; '.join(failures)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Small harness for timing thtools benchmarks and recording the results
+
+"""
+
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+
+class Result(object):
+    """
+    Timings of one benchmark case
+
+    :param str name: Name of the case
+    :param list(float) times: Wall time of each repetition in seconds
+    :param int items: Number of items (e.g., files or objects) processed by
+        each repetition
+    :param int n_bytes: Number of bytes processed by each repetition
+    :param int peak_memory: Peak memory traced by tracemalloc during one
+        extra repetition, in bytes
+    """
+
+    def __init__(self, name, times, items=None, n_bytes=None,
+                 peak_memory=None):
+        self.name = name
+        self.times = times
+        self.items = items
+        self.n_bytes = n_bytes
+        self.peak_memory = peak_memory
+
+    def percentile(self, p):
+        times = sorted(self.times)
+        return times[min(len(times) - 1, int(round(p / 100. * (len(times)
+                                                                - 1))))]
+
+    def to_dict(self):
+        median = statistics.median(self.times)
+        d = {'name': self.name, 'repeat': len(self.times),
+             'p50': median, 'p90': self.percentile(90),
+             'p99': self.percentile(99), 'min': min(self.times),
+             'peak_memory': self.peak_memory}
+        if self.items:
+            d['items_per_s'] = self.items / median
+        if self.n_bytes:
+            d['mb_per_s'] = self.n_bytes / median / 1e6
+        return d
+
+
+def measure(name, func, setup=None, repeat=5, items=None, n_bytes=None,
+            trace_memory=True):
+    """
+    Time `func` `repeat` times, calling `setup` (untimed) before each
+
+    Peak memory is measured in a separate run under tracemalloc, so that
+    tracing does not distort the timings.
+
+    :return: The timings
+    :rtype: Result
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    peak = None
+    if trace_memory:
+        if setup is not None:
+            setup()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return Result(name, times, items=items, n_bytes=n_bytes,
+                  peak_memory=peak)
+
+
+def report(results, baseline=None):
+    """
+    Print a table of results, with the change from `baseline` if given
+
+    :param list(Result) results: The results to show
+    :param dict baseline: Default: None. Previous results as loaded by
+        :func:`load`, to compare median times with.
+    """
+    header = '{:<44}{:>10}{:>10}{:>10}{:>12}{:>10}'.format(
+        'case', 'p50 ms', 'p90 ms', 'p99 ms', 'rate', 'peak MB')
+    if baseline:
+        header += '{:>10}'.format('vs base')
+    print(header)
+    for result in results:
+        d = result.to_dict()
+        if 'mb_per_s' in d:
+            rate = '{:.1f} MB/s'.format(d['mb_per_s'])
+        elif 'items_per_s' in d:
+            rate = '{:.0f} /s'.format(d['items_per_s'])
+        else:
+            rate = ''
+        peak = '' if d['peak_memory'] is None else '{:.1f}'.format(
+            d['peak_memory'] / 1e6)
+        line = '{:<44}{:>10.3f}{:>10.3f}{:>10.3f}{:>12}{:>10}'.format(
+            d['name'], 1e3 * d['p50'], 1e3 * d['p90'], 1e3 * d['p99'], rate,
+            peak)
+        if baseline and d['name'] in baseline:
+            line += '{:>9.2f}x'.format(d['p50'] / baseline[d['name']]['p50'])
+        print(line)
+
+
+def save(results, path, params=None):
+    """Write `results` and some information about the machine to JSON"""
+    data = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'params': params or {},
+            'results': [result.to_dict() for result in results]}
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def load(path):
+    """
+    Load results saved by :func:`save`
+
+    :return: Dict from case names to their result dicts
+    :rtype: dict
+    """
+    with open(path) as f:
+        data = json.load(f)
+    return {d['name']: d for d in data['results']}
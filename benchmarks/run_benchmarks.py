@@ -0,0 +1,314 @@
+#! /usr/bin/env python3
+
+"""
+Benchmark the thtools hot paths on synthetic workloads
+
+Run from the top of the repository, e.g.
+    python benchmarks/run_benchmarks.py --output base.json
+    (make changes)
+    python benchmarks/run_benchmarks.py --compare base.json
+
+Suites: saving (large and many small pickles), clean (scratch trees, in
+tmpfs at /dev/shm when available; use --files 1000000 for a full-size
+tree), resolve (deep search paths), dicts (large nested dicts) and jobs
+(fake qstat/qconf executables put first on PATH).
+"""
+
+import argparse
+import array
+import functools
+import os
+import random
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import harness  # noqa: E402
+from thtools import (clean_compute_node, dict_tools, dirs,  # noqa: E402
+                     job_tools, saving)
+
+
+def bench_saving(tmp, args):
+    base = os.path.join(tmp, '')
+    saving.make_obj_dir(base, sharded=True)
+    large = array.array('d', range(args.large_mb * (1 << 20) // 8))
+    n_large = len(large) * large.itemsize
+    small = [{'frame': i, 'energy': random.random(), 'label': 'x' * 20}
+             for i in range(args.objects)]
+    names = [base + 'frame{}'.format(i) for i in range(args.objects)]
+    saving.save_obj(large, base + 'large_oob', out_of_band=True)
+
+    def save_small():
+        for name, obj in zip(names, small):
+            saving.save_obj(obj, name)
+
+    def load_small():
+        for name in names:
+            saving.load_obj(name)
+
+    results = [
+        harness.measure('save_obj large', functools.partial(
+            saving.save_obj, large, base + 'large'), repeat=args.repeat,
+            n_bytes=n_large),
+        harness.measure('load_obj large', functools.partial(
+            saving.load_obj, base + 'large'), repeat=args.repeat,
+            n_bytes=n_large),
+        harness.measure('save_obj large out_of_band', functools.partial(
+            saving.save_obj, large, base + 'large_oob', out_of_band=True),
+            repeat=args.repeat, n_bytes=n_large),
+        harness.measure('load_obj large mmap', functools.partial(
+            saving.load_obj, base + 'large_oob', mmap=True),
+            repeat=args.repeat, n_bytes=n_large),
+        harness.measure('save_obj many small', save_small,
+                        repeat=args.repeat, items=args.objects),
+        harness.measure('load_obj many small', load_small,
+                        repeat=args.repeat, items=args.objects),
+        harness.measure('save_many sharded', functools.partial(
+            saving.save_many, dict(zip(names, small)), sharded=True),
+            repeat=args.repeat, items=args.objects),
+        harness.measure('load_many sharded', functools.partial(
+            saving.load_many, names, sharded=True), repeat=args.repeat,
+            items=args.objects),
+    ]
+    return results
+
+
+def make_scratch_tree(root, n_files, per_dir=1000, old_fraction=0.5):
+    """Create `n_files` small files in directories of `per_dir` files"""
+    old = time.time() - 30 * 86400
+    rng = random.Random(0)
+    for i in range(n_files):
+        d = os.path.join(root, 'job{}'.format(i // per_dir))
+        if i % per_dir == 0:
+            os.makedirs(d)
+        path = os.path.join(d, 'f{}'.format(i))
+        with open(path, 'wb') as f:
+            f.write(b'x' * rng.randrange(64))
+        if rng.random() < old_fraction:
+            os.utime(path, (old, old))
+
+
+def bench_clean(tmp, args):
+    shm = '/dev/shm'
+    parent = shm if os.access(shm, os.W_OK) else tmp
+    root = tempfile.mkdtemp(prefix='thtools-bench-', dir=parent)
+    try:
+        make_scratch_tree(root, args.files)
+        index = clean_compute_node.ScratchIndex(os.path.join(tmp,
+                                                             'index.sqlite'))
+
+        def consume():
+            for _ in clean_compute_node.scan_tree(root, older_than=7):
+                pass
+
+        def walk_stat():  # the traversal scan_tree replaces
+            cutoff = time.time() - 7 * 86400
+            for d, _, files in os.walk(root):
+                for f in files:
+                    os.stat(os.path.join(d, f)).st_mtime < cutoff
+
+        results = [
+            harness.measure('os.walk + stat', walk_stat, repeat=args.repeat,
+                            items=args.files),
+            harness.measure('scan_tree', consume, repeat=args.repeat,
+                            items=args.files),
+            harness.measure('ScratchIndex.refresh (first)', functools.partial(
+                index.refresh, root), repeat=1, items=args.files,
+                trace_memory=False),
+            harness.measure('ScratchIndex.refresh (unchanged)',
+                            functools.partial(index.refresh, root),
+                            repeat=args.repeat, items=args.files),
+            harness.measure('ScratchIndex.oldest(100)', functools.partial(
+                index.oldest, 100), repeat=args.repeat),
+        ]
+        index.close()
+        results.append(harness.measure(
+            'remove_entries(scan_tree)', lambda: clean_compute_node.
+            remove_entries(clean_compute_node.scan_tree(root, older_than=7)),
+            repeat=1, trace_memory=False))
+        return results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_resolve(tmp, args):
+    search = []
+    for i in range(args.dirs):
+        d = os.path.join(tmp, 'ff{}'.format(i))
+        os.makedirs(d)
+        for j in range(200):
+            open(os.path.join(d, 'ff{}_{}.itp'.format(i, j)), 'w').close()
+        search.append(d)
+    # the worst case: files found only in the last directories
+    names = ['ff{}_{}.itp'.format(args.dirs - 1 - i % 3, i % 200)
+             for i in range(args.lookups)]
+    resolver = dirs.PathResolver(*search)
+
+    def resolve_each():
+        for name in names:
+            dirs.resolve_path(name, *search)
+
+    return [
+        harness.measure('resolve_path', resolve_each, repeat=args.repeat,
+                        items=args.lookups),
+        harness.measure('PathResolver.resolve_many', functools.partial(
+            resolver.resolve_many, names), repeat=args.repeat,
+            items=args.lookups),
+    ]
+
+
+def make_nested(rng, n_keys, depth):
+    d = {}
+    for i in range(n_keys):
+        key = 'key{}'.format(i)
+        if depth and rng.random() < 0.1:
+            d[key] = make_nested(rng, max(2, n_keys // 10), depth - 1)
+        else:
+            d[key] = rng.random()
+    return d
+
+
+def bench_dicts(tmp, args):
+    rng = random.Random(0)
+    layers = [make_nested(rng, args.keys, 3) for _ in range(args.layers)]
+    return [
+        harness.measure('merge_two_dicts fold', lambda: functools.reduce(
+            dict_tools.merge_two_dicts, layers, {}), repeat=args.repeat,
+            items=args.layers),
+        harness.measure('merge_dicts deep=False', lambda: dict_tools.
+                        merge_dicts(*layers, deep=False),
+                        repeat=args.repeat, items=args.layers),
+        harness.measure('merge_dicts deep=True', lambda: dict_tools.
+                        merge_dicts(*layers), repeat=args.repeat,
+                        items=args.layers),
+        harness.measure('LayeredDict 1000 lookups', lambda: [
+            dict_tools.LayeredDict(*layers)['key{}'.format(i)]
+            for i in range(min(1000, args.keys))], repeat=args.repeat),
+    ]
+
+
+FAKE_QSTAT = '''#!/bin/sh
+echo call >> "{log}"
+cat "{xml}"
+'''
+
+FAKE_QCONF = '''#!/bin/sh
+echo call >> "{log}"
+for h in $(echo "$2" | tr ',' ' '); do
+  echo "hostname              $h"
+  echo "load_values           num_proc=16,mem_total=128833.382812M"
+done
+'''
+
+
+def bench_jobs(tmp, args):
+    bin_dir = os.path.join(tmp, 'bin')
+    os.makedirs(bin_dir)
+    log = os.path.join(tmp, 'calls.log')
+    xml = os.path.join(tmp, 'qstat.xml')
+    with open(xml, 'w') as f:
+        f.write("<?xml version='1.0'?>\n<job_info><queue_info>\n")
+        for i in range(args.jobs):
+            f.write('<job_list state="running"><JB_job_number>{0}'
+                    '</JB_job_number><JB_name>job_{0}</JB_name><state>r'
+                    '</state><slots>1</slots></job_list>\n'.format(i))
+        f.write('</queue_info><job_info></job_info></job_info>\n')
+    for name, text in (('qstat', FAKE_QSTAT), ('qconf', FAKE_QCONF)):
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as f:
+            f.write(text.format(log=log, xml=xml))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    old_path = os.environ['PATH']
+    os.environ['PATH'] = bin_dir + os.pathsep + old_path
+    nodes = ['node{}'.format(i) for i in range(50)]
+    polls = 20
+    try:
+        def poll_uncached():
+            for _ in range(polls):
+                job_tools.running_jobs_names('me', max_age=0)
+
+        def poll_cached():
+            job_tools.clear_scheduler_cache()
+            for _ in range(polls):
+                job_tools.running_jobs_names('me')
+
+        def hosts_each():
+            job_tools.clear_scheduler_cache()
+            for node in nodes:
+                job_tools.get_hosts([node])
+
+        def hosts_bulk():
+            job_tools.clear_scheduler_cache()
+            job_tools.get_hosts(nodes)
+
+        results = []
+        for name, func, items in (
+                ('running_jobs_names x{} uncached'.format(polls),
+                 poll_uncached, polls),
+                ('running_jobs_names x{} cached'.format(polls), poll_cached,
+                 polls),
+                ('get_hosts one node at a time', hosts_each, len(nodes)),
+                ('get_hosts bulk', hosts_bulk, len(nodes))):
+            open(log, 'w').close()
+            result = harness.measure(name, func, repeat=args.repeat,
+                                     items=items, trace_memory=False)
+            with open(log) as f:
+                calls = sum(1 for _ in f) / float(args.repeat)
+            result.name += ' ({:g} calls)'.format(calls)
+            results.append(result)
+        return results
+    finally:
+        os.environ['PATH'] = old_path
+        job_tools.clear_scheduler_cache()
+
+
+SUITES = {'saving': bench_saving, 'clean': bench_clean,
+          'resolve': bench_resolve, 'dicts': bench_dicts, 'jobs': bench_jobs}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--suites', nargs='+', choices=sorted(SUITES),
+                        default=sorted(SUITES))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    parser.add_argument('--compare',
+                        help='Compare with results saved with --output')
+    parser.add_argument('--large-mb', type=int, default=64,
+                        help='Size of the large pickle')
+    parser.add_argument('--objects', type=int, default=2000,
+                        help='Number of small pickles')
+    parser.add_argument('--files', type=int, default=20000,
+                        help='Number of files in the scratch tree')
+    parser.add_argument('--dirs', type=int, default=30,
+                        help='Number of directories in the search path')
+    parser.add_argument('--lookups', type=int, default=2000,
+                        help='Number of files to resolve')
+    parser.add_argument('--layers', type=int, default=50,
+                        help='Number of dicts to merge')
+    parser.add_argument('--keys', type=int, default=2000,
+                        help='Number of keys in each dict')
+    parser.add_argument('--jobs', type=int, default=500,
+                        help='Number of jobs listed by the fake qstat')
+    args = parser.parse_args(argv)
+    baseline = harness.load(args.compare) if args.compare else None
+    results = []
+    for suite in args.suites:
+        print('== {}'.format(suite))
+        with tempfile.TemporaryDirectory() as tmp:
+            suite_results = SUITES[suite](tmp, args)
+        for result in suite_results:
+            result.name = '{}: {}'.format(suite, result.name)
+        harness.report(suite_results, baseline)
+        results.extend(suite_results)
+    if args.output:
+        harness.save(results, args.output, params=vars(args))
+
+
+if __name__ == '__main__':
+    main()
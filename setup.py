@@ -8,6 +8,7 @@ setup(
     author_email='thomasjheavey@gmail.com',
     description='Tools and such I use regularly for productivity',
     install_requires=[],
+    python_requires='>=3.9',
     zip_safe=True,
 )
 
@@ -0,0 +1,119 @@
+"""
+Shared fixtures: stand-ins for the SGE commands
+
+"""
+
+import os
+import stat
+
+import pytest
+
+from thtools import job_tools
+
+FAKE_QSTAT = '''#!/bin/sh
+echo "qstat $*" >> "{log}"
+sleep "$(cat "{root}/qstat.delay")"
+cat "{root}/qstat.stderr" >&2
+cat "{xml}"
+exit "$(cat "{root}/qstat.status")"
+'''
+
+FAKE_QCONF = '''#!/bin/sh
+echo "qconf $*" >> "{log}"
+sleep "$(cat "{root}/qconf.delay")"
+for h in $(echo "$2" | tr ',' ' '); do
+  if [ -f "{hosts}/$h" ]; then cat "{hosts}/$h"; fi
+done
+'''
+
+
+def write_atomic(path, text):
+    """
+    Replace the file at `path` in one step, so a fake command running
+    concurrently (e.g. while a test's timer changes the jobs) never reads
+    it half written
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class FakeScheduler(object):
+    """
+    Fake `qstat` and `qconf` executables first on PATH
+
+    `qstat` prints the XML last given to :meth:`set_jobs` or
+    :meth:`set_xml`, and `qconf -se h1,h2` prints the text given to
+    :meth:`add_host` for each host it knows. Every call is logged, see
+    :meth:`calls`, and can be slowed down with :meth:`set_delay`.
+    """
+
+    def __init__(self, root):
+        self.root = str(root)
+        self.bin = os.path.join(self.root, 'bin')
+        self.hosts = os.path.join(self.root, 'hosts')
+        self.log = os.path.join(self.root, 'calls.log')
+        self.xml = os.path.join(self.root, 'qstat.xml')
+        os.makedirs(self.bin)
+        os.makedirs(self.hosts)
+        for name, text in (('qstat', FAKE_QSTAT), ('qconf', FAKE_QCONF)):
+            path = os.path.join(self.bin, name)
+            with open(path, 'w') as f:
+                f.write(text.format(root=self.root, log=self.log,
+                                    xml=self.xml, hosts=self.hosts))
+            os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+            self.set_delay(name, 0)
+        open(self.log, 'w').close()
+        self.set_failure('', 0)
+        self.set_jobs([])
+
+    def set_delay(self, command, seconds):
+        write_atomic(os.path.join(self.root, command + '.delay'),
+                     str(seconds))
+
+    def set_failure(self, stderr, status=1):
+        """Make `qstat` write `stderr` to stderr and exit with `status`"""
+        write_atomic(os.path.join(self.root, 'qstat.stderr'), stderr)
+        write_atomic(os.path.join(self.root, 'qstat.status'), str(status))
+
+    def set_xml(self, text):
+        write_atomic(self.xml, text)
+
+    def set_jobs(self, jobs):
+        """
+        :param jobs: (job_id, state) pairs, or (job_id, state, tasks)
+        """
+        items = []
+        for job in jobs:
+            job_id, state = job[:2]
+            tasks = '<tasks>{}</tasks>'.format(job[2]) if len(job) > 2 else ''
+            items.append(
+                '<job_list state="{1}"><JB_job_number>{0}</JB_job_number>'
+                '<JB_name>job_{0}</JB_name><JB_owner>me</JB_owner>'
+                '<state>{1}</state><slots>1</slots>{2}</job_list>'.format(
+                    job_id, state, tasks))
+        self.set_xml("<?xml version='1.0'?>\n<job_info><queue_info>{}"
+                     "</queue_info><job_info></job_info></job_info>\n".format(
+                         ''.join(items)))
+
+    def add_host(self, name, text):
+        write_atomic(os.path.join(self.hosts, name), text)
+
+    def calls(self, command=None):
+        """The logged command lines, optionally only those of `command`"""
+        with open(self.log) as f:
+            lines = f.read().splitlines()
+        if command is not None:
+            lines = [line for line in lines if line.split()[0] == command]
+        return lines
+
+
+@pytest.fixture
+def fake_sge(tmp_path, monkeypatch):
+    scheduler = FakeScheduler(tmp_path / 'sge')
+    monkeypatch.setenv('PATH', scheduler.bin + os.pathsep +
+                       os.environ.get('PATH', ''))
+    job_tools.clear_scheduler_cache()
+    yield scheduler
+    job_tools.clear_scheduler_cache()
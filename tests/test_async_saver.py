@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from thtools.saving import AsyncSaver, load_obj
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+@pytest.fixture
+def obj_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('obj')
+    return tmp_path / 'obj'
+
+
+def test_save_and_close(obj_dir):
+    with AsyncSaver() as saver:
+        for i in range(5):
+            saver.save([i] * 10, 'obj{}'.format(i))
+    assert [load_obj('obj{}'.format(i)) for i in range(5)] == [
+        [i] * 10 for i in range(5)]
+    with pytest.raises(ValueError):
+        saver.save(1, 'closed')
+
+
+def test_error_is_raised(obj_dir):
+    saver = AsyncSaver()
+    saver.save(1, os.path.join('missing', 'x'))
+    with pytest.raises(FileNotFoundError):
+        saver.close()
+
+
+def test_queue_is_saved_at_exit_without_close(obj_dir):
+    code = '''
+from thtools.saving import AsyncSaver
+saver = AsyncSaver(maxsize=20)
+for i in range(20):
+    saver.save(list(range(200000)), 'obj{}'.format(i))
+'''
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.run([sys.executable, '-c', code], check=True, env=env)
+    assert sorted(os.listdir(str(obj_dir))) == sorted(
+        'obj{}.pkl'.format(i) for i in range(20))
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from thtools import job_tools
+from thtools.saving import iter_load, load_many, make_obj_dir, save_many
+
+
+@pytest.fixture
+def obj_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    make_obj_dir()
+    return tmp_path / 'obj'
+
+
+@pytest.mark.parametrize('sharded', [False, True])
+def test_save_and_load_many(obj_dir, sharded):
+    objs = {'obj{}'.format(i): list(range(i)) for i in range(50)}
+    paths = save_many(objs, sharded=sharded)
+    assert all(os.path.exists(path) for path in paths.values())
+    assert load_many(objs, sharded=sharded) == objs
+    assert dict(iter_load(objs, workers=2, sharded=sharded)) == objs
+
+
+def test_default_workers_without_probe(obj_dir, monkeypatch):
+    def fail(refresh=False):
+        raise KeyError('HOSTNAME')
+
+    monkeypatch.setattr(job_tools, 'probe_node_resources', fail)
+    save_many({'a': 1, 'b': 2})
+    assert load_many(['a', 'b']) == {'a': 1, 'b': 2}
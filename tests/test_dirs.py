@@ -0,0 +1,117 @@
+import asyncio
+import os
+
+import pytest
+
+from thtools.dirs import (PathResolver, local_cd, local_getcwd, local_listdir,
+                          local_open, local_stat, resolve_path)
+
+
+@pytest.fixture
+def search_dirs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for d in ('a', 'b', os.path.join('b', 'top')):
+        os.mkdir(d)
+    for path in ('here.top', os.path.join('a', 'x.itp'),
+                 os.path.join('b', 'x.itp'), os.path.join('b', 'y.itp'),
+                 os.path.join('b', 'top', 'z.itp')):
+        open(path, 'w').close()
+    return ['a', 'b']
+
+
+NAMES = ['here.top', 'x.itp', 'y.itp', os.path.join('top', 'z.itp'),
+         'missing.itp']
+
+
+def test_same_as_resolve_path(search_dirs):
+    resolver = PathResolver(*search_dirs)
+    expected = [resolve_path(f, *search_dirs) for f in NAMES]
+    assert [resolver.resolve(f) for f in NAMES] == expected
+    assert resolver.resolve_many(NAMES) == expected
+
+
+def test_resolve_sees_changes_immediately(search_dirs):
+    resolver = PathResolver(*search_dirs)
+    assert resolver.resolve('x.itp') == os.path.abspath('a/x.itp')
+    os.remove(os.path.join('a', 'x.itp'))
+    assert resolver.resolve('x.itp') == os.path.abspath('b/x.itp')
+    open(os.path.join('a', 'new.itp'), 'w').close()
+    assert resolver.resolve('new.itp') == os.path.abspath('a/new.itp')
+    assert resolver.resolve_many(['x.itp', 'new.itp']) == [
+        os.path.abspath('b/x.itp'), os.path.abspath('a/new.itp')]
+
+
+def test_max_age_trusts_listings(search_dirs):
+    resolver = PathResolver(*search_dirs, max_age=60.)
+    assert resolver.resolve('x.itp') == os.path.abspath('a/x.itp')
+    os.remove(os.path.join('a', 'x.itp'))
+    assert resolver.resolve('x.itp') == os.path.abspath('a/x.itp')
+    # resolve_many and invalidate always check
+    assert resolver.resolve_many(['x.itp']) == [os.path.abspath('b/x.itp')]
+    resolver.invalidate()
+    assert resolver.resolve('x.itp') == os.path.abspath('b/x.itp')
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def test_local_cd_nesting(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join('a', 'sub'))
+    write(os.path.join('a', 'sub', 'f'), 'sub')
+    with local_cd('a') as a:
+        assert a == str(tmp_path / 'a')
+        with local_cd('sub'):
+            assert local_getcwd() == str(tmp_path / 'a' / 'sub')
+            with local_open('f') as f:
+                assert f.read() == 'sub'
+            assert local_listdir() == ['f']
+        assert local_getcwd() == a
+    assert os.getcwd() == str(tmp_path)
+
+
+def test_local_cd_task_outlives_block(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for d in ('a', 'b'):
+        os.mkdir(d)
+        write(os.path.join(d, 'f'), d)
+
+    async def read_later(started, go):
+        started.set()
+        await go.wait()
+        with local_open('f') as f:
+            return f.read(), local_stat('f').st_size
+
+    async def main():
+        started, go = asyncio.Event(), asyncio.Event()
+        with local_cd('a'):
+            task = asyncio.ensure_future(read_later(started, go))
+            await started.wait()
+        # the task still uses 'a' after the block closed its reference,
+        # even when other directories are opened in the meantime
+        with local_cd('b'):
+            with local_cd('.'):
+                go.set()
+                return await task
+
+    assert asyncio.run(main()) == ('a', 1)
+
+
+def test_resolve_stats_each_directory_once(search_dirs, monkeypatch):
+    resolver = PathResolver(*search_dirs + ['./a', 'b/../b'])
+    stats = []
+    stat = os.stat
+
+    def counting_stat(path, *args, **kwargs):
+        stats.append(path)
+        return stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, 'stat', counting_stat)
+    assert resolver.resolve('here.top') == os.path.abspath('here.top')
+    assert stats == [os.getcwd()]  # found in the first directory
+    del stats[:]
+    assert resolver.resolve('missing') == 'missing'
+    assert sorted(stats) == sorted({os.getcwd(), os.path.abspath('a'),
+                                    os.path.abspath('b')})
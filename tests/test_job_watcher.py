@@ -0,0 +1,115 @@
+import asyncio
+import threading
+
+import pytest
+
+from thtools.job_tools import JobWatcher, running_jobs_names
+
+
+def kinds(events):
+    return [(event.kind, event.job_id) for event in events]
+
+
+def test_first_poll_has_no_events(fake_sge):
+    fake_sge.set_jobs([(1, 'r'), (2, 'qw')])
+    watcher = JobWatcher('me')
+    assert watcher.poll(0) == []
+    assert sorted(watcher.jobs) == ['1', '2']
+
+
+def test_started_failed_finished(fake_sge):
+    fake_sge.set_jobs([(1, 'qw'), (2, 'qw'), (3, 'r')])
+    watcher = JobWatcher('me')
+    seen = []
+    watcher.on('started', seen.append)
+    watcher.poll(0)
+    fake_sge.set_jobs([(1, 'r'), (2, 'Eqw')])
+    assert sorted(kinds(watcher.poll(0))) == [
+        ('failed', '2'), ('finished', '3'), ('started', '1')]
+    assert kinds(seen) == [('started', '1')]
+    # no change, no events
+    assert watcher.poll(0) == []
+
+
+def test_array_job_started_by_any_task(fake_sge):
+    fake_sge.set_jobs([(5, 'qw', '1-4')])
+    watcher = JobWatcher('me')
+    watcher.poll(0)
+    fake_sge.set_jobs([(5, 'r', '1'), (5, 'qw', '2-4')])
+    assert kinds(watcher.poll(0)) == [('started', '5')]
+
+
+def test_unknown_event_kind(fake_sge):
+    with pytest.raises(ValueError):
+        JobWatcher('me').on('exploded', print)
+
+
+def test_backoff_and_reset(fake_sge):
+    fake_sge.set_jobs([(1, 'r')])
+    watcher = JobWatcher('me', min_interval=1., max_interval=3.,
+                         backoff=2.)
+    watcher.poll(0)
+    assert watcher.interval == 2.
+    watcher.poll(0)
+    assert watcher.interval == 3.
+    watcher.poll(0)
+    assert watcher.interval == 3.
+    fake_sge.set_jobs([])
+    watcher.poll(0)  # 'finished'
+    assert watcher.interval == 1.
+
+
+def test_poll_uses_cache(fake_sge):
+    watcher = JobWatcher('me', min_interval=60.)
+    watcher.poll()
+    watcher.poll()
+    assert len(fake_sge.calls('qstat')) == 1
+
+
+def test_wait_for_finishes(fake_sge):
+    fake_sge.set_jobs([(7, 'r'), (8, 'r')])
+    watcher = JobWatcher('me', min_interval=0.01, max_interval=0.05)
+    timer = threading.Timer(0.2, fake_sge.set_jobs, [[(8, 'r')]])
+    timer.start()
+    try:
+        watcher.wait_for([7], timeout=10.)
+    finally:
+        timer.cancel()
+    assert '7' not in watcher.jobs
+
+
+def test_wait_for_timeout(fake_sge):
+    fake_sge.set_jobs([(7, 'r')])
+    watcher = JobWatcher('me', min_interval=0.01, max_interval=0.05)
+    with pytest.raises(TimeoutError):
+        watcher.wait_for([7], timeout=0.1)
+
+
+def test_wait_for_never_listed_job_times_out(fake_sge):
+    watcher = JobWatcher('me', min_interval=0.01, max_interval=0.05)
+    with pytest.raises(TimeoutError):
+        watcher.wait_for([4], timeout=0.1)
+
+
+def test_wait_for_ignores_stale_cache(fake_sge):
+    # a job list cached before the job was submitted must not make it
+    # look finished
+    assert running_jobs_names('me') == []
+    fake_sge.set_jobs([(7, 'r')])
+    watcher = JobWatcher('me', min_interval=0.01, max_interval=0.05)
+    with pytest.raises(TimeoutError):
+        watcher.wait_for([7], timeout=0.2)
+
+
+def test_events_first_poll_is_fresh(fake_sge):
+    assert running_jobs_names('me') == []
+    fake_sge.set_jobs([(7, 'r')])
+    watcher = JobWatcher('me', min_interval=0.01, max_interval=0.05)
+
+    async def first_event():
+        async for event in watcher.events():
+            return event
+
+    threading.Timer(0.2, fake_sge.set_jobs, [[]]).start()
+    event = asyncio.run(asyncio.wait_for(first_event(), 10.))
+    assert (event.kind, event.job_id) == ('finished', '7')
@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+from thtools import job_tools
+
+
+@pytest.fixture
+def no_proc(monkeypatch):
+    """Make the local probe fail, as off Linux"""
+    def fail(n_slots):
+        raise FileNotFoundError('/proc/meminfo')
+
+    monkeypatch.setattr(job_tools, '_probe_local', fail)
+    monkeypatch.setattr(job_tools, '_resources', None)
+    monkeypatch.delenv('NSLOTS', raising=False)
+
+
+def test_fallback_without_hostname(no_proc, monkeypatch):
+    monkeypatch.delenv('HOSTNAME', raising=False)
+    resources = job_tools.probe_node_resources(refresh=True)
+    assert resources.source == 'fallback'
+    assert resources.n_cpus == os.cpu_count()
+    assert resources.usable_mem is None
+    assert resources.workers(mem_per_worker=1000.) == resources.usable_cpus
+    with pytest.raises(ValueError):
+        job_tools.get_node_mem()
+
+
+def test_fallback_without_qconf(no_proc, monkeypatch, tmp_path):
+    monkeypatch.setenv('HOSTNAME', 'laptop')
+    monkeypatch.setenv('PATH', str(tmp_path))
+    resources = job_tools.probe_node_resources(refresh=True)
+    assert resources.source == 'fallback'
+
+
+def test_qconf(no_proc, monkeypatch, fake_sge):
+    monkeypatch.setenv('HOSTNAME', 'scc-na1')
+    fake_sge.add_host('scc-na1', 'hostname scc-na1.scc.bu.edu\n'
+                                 'load_values num_proc=16,'
+                                 'mem_total=128000.0M\n')
+    resources = job_tools.probe_node_resources(refresh=True)
+    assert resources.source == 'qconf'
+    assert (resources.n_cpus, resources.mem_total) == (16, 128000.)
+
+
+def test_local():
+    if not os.path.exists('/proc/meminfo'):
+        pytest.skip('no /proc/meminfo')
+    resources = job_tools.probe_node_resources(refresh=True)
+    assert resources.source == 'local'
+    assert resources.mem_total > 0
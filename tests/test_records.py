@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from thtools.saving import RecordReader, RecordWriter
+
+
+@pytest.fixture
+def obj_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('obj')
+    return tmp_path / 'obj'
+
+
+def test_reopen_without_index_removes_stale_index(obj_dir):
+    with RecordWriter('log', index=True) as w:
+        for i in range(5):
+            w.append(i)
+    with RecordWriter('log') as w:
+        for i in range(5, 8):
+            w.append(i)
+    assert not (obj_dir / 'log.rec.idx').exists()
+    with RecordReader('log') as r:
+        assert len(r) == 8
+        assert r[6] == 6
+
+
+def test_reader_rescans_when_index_is_behind(obj_dir):
+    with RecordWriter('log', index=True) as w:
+        for i in range(5):
+            w.append(i)
+    stale = (obj_dir / 'log.rec.idx').read_bytes()
+    with RecordWriter('log', index=True) as w:
+        for i in range(5, 8):
+            w.append(i)
+    (obj_dir / 'log.rec.idx').write_bytes(stale)
+    with open(str(obj_dir / 'log.rec'), 'ab') as f:
+        f.write(b'\x05\x00')  # start of a partially written record
+    with RecordReader('log') as r:
+        assert len(r) == 8
+        assert r[7] == 7
+        assert list(r) == list(range(8))
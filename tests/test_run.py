@@ -0,0 +1,30 @@
+import asyncio
+import sys
+
+from thtools.job_tools import arun, run, run_many
+
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+
+def test_run_merges_stderr():
+    proc = run(python('import sys; print("out"); '
+                      'sys.stderr.write("err\\n")'))
+    assert proc.returncode == 0
+    assert sorted(proc.stdout.split()) == ['err', 'out']
+
+
+def test_arun_lines_and_callbacks():
+    seen = []
+    proc = asyncio.run(arun(python('print("a"); print("b", end="")'),
+                            on_stdout=seen.append))
+    assert seen == ['a\n', 'b']
+    assert proc.stdout == 'a\nb'
+
+
+def test_run_many_long_lines():
+    procs = run_many([python('print("x" * 200000)'),
+                      python('print("y" * 100000 + "\\n" + "z" * 70000)')])
+    assert procs[0].stdout == 'x' * 200000 + '\n'
+    assert procs[1].stdout.split('\n') == ['y' * 100000, 'z' * 70000, '']
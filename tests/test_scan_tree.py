@@ -0,0 +1,67 @@
+import os
+import shutil
+import time
+
+from thtools import clean_compute_node
+from thtools.clean_compute_node import remove_entries, scan_tree
+
+
+def make_tree(root, n_files=100):
+    os.makedirs(os.path.join(root, 'sub', 'deeper'))
+    for d in ('', 'sub', os.path.join('sub', 'deeper')):
+        for i in range(n_files):
+            with open(os.path.join(root, d, 'f{}'.format(i)), 'w') as f:
+                f.write('x')
+
+
+def test_scan_tree_finds_everything(tmp_path):
+    make_tree(str(tmp_path), 3)
+    entries = list(scan_tree(str(tmp_path), cutoff=time.time() + 10))
+    assert sum(not e.is_dir for e in entries) == 9
+    # directories come after their contents
+    assert [e.name for e in entries if e.is_dir] == [
+        os.path.join('sub', 'deeper'), 'sub']
+
+
+def test_entries_removed_during_scan_are_skipped(tmp_path):
+    root = str(tmp_path)
+    make_tree(root)
+    entries = scan_tree(root, cutoff=time.time() + 10)
+    first = next(entries)
+    # remove everything the scan has not reached yet
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if path == first.path:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    assert list(entries) == []
+
+
+def test_unreadable_directory_is_skipped_and_reported(tmp_path,
+                                                      monkeypatch):
+    root = str(tmp_path)
+    make_tree(root, 2)
+    blocked = os.path.join(root, 'sub')
+    scandir = os.scandir
+
+    def fake_scandir(path):
+        if path == blocked:
+            raise PermissionError(13, 'Permission denied', path)
+        return scandir(path)
+
+    monkeypatch.setattr(clean_compute_node.os, 'scandir', fake_scandir)
+    errors = []
+    entries = list(scan_tree(root, cutoff=time.time() + 10,
+                             onerror=errors.append))
+    assert sorted(e.name for e in entries) == ['f0', 'f1']
+    assert [e.filename for e in errors] == [blocked]
+
+
+def test_remove_entries(tmp_path):
+    root = str(tmp_path)
+    make_tree(root, 2)
+    assert remove_entries(scan_tree(root, cutoff=time.time() + 10)) == 8
+    assert os.listdir(root) == []
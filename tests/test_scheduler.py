@@ -0,0 +1,187 @@
+import subprocess
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+from thtools import job_tools
+from thtools.job_tools import (clear_scheduler_cache, get_hosts, get_jobs,
+                               running_jobs_names)
+
+NAMESPACED_XML = '''<?xml version='1.0'?>
+<job_info xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+  <queue_info>
+    <job_list state="running">
+      <JB_job_number>101</JB_job_number>
+      <JB_name>opt</JB_name>
+      <JB_owner>me</JB_owner>
+      <state>r</state>
+      <queue_name>a128@scc-na1.scc.bu.edu</queue_name>
+      <slots>16</slots>
+      <JAT_start_time>2018-05-01T10:00:00</JAT_start_time>
+    </job_list>
+  </queue_info>
+  <job_info>
+    <job_list state="pending">
+      <JB_job_number>102</JB_job_number>
+      <JB_name>array</JB_name>
+      <JB_owner>me</JB_owner>
+      <state>qw</state>
+      <slots>1</slots>
+      <tasks>2-10:1</tasks>
+      <JB_submission_time>2018-05-01T09:00:00</JB_submission_time>
+    </job_list>
+  </job_info>
+</job_info>
+'''
+
+DEFAULT_NS_XML = NAMESPACED_XML.replace('xmlns:xsd=', 'xmlns=')
+
+HOST = '''hostname              {}
+load_scaling          NONE
+complex_values        h_vmem=125G,\\
+                      cpu_arch=broadwell
+load_values           arch=lx-amd64,num_proc=28,\\
+                      mem_total=257844.320312M,\\
+                      np_load_avg=0.5
+processors            28
+'''
+
+
+def test_get_jobs_parses_xml(fake_sge):
+    for xml in (NAMESPACED_XML, DEFAULT_NS_XML):
+        fake_sge.set_xml(xml)
+        jobs = get_jobs('me', max_age=0)
+        assert [(j.job_id, j.name, j.state, j.slots, j.tasks)
+                for j in jobs] == [('101', 'opt', 'r', 16, None),
+                                   ('102', 'array', 'qw', 1, '2-10:1')]
+        assert jobs[0].queue == 'a128@scc-na1.scc.bu.edu'
+        assert jobs[0].start_time == '2018-05-01T10:00:00'
+        assert jobs[1].submission_time == '2018-05-01T09:00:00'
+    assert fake_sge.calls('qstat')[-1] == 'qstat -xml -u me'
+
+
+def test_get_hosts_parses_continuation_lines(fake_sge):
+    fake_sge.add_host('scc-na1', HOST.format('scc-na1.scc.bu.edu'))
+    host = get_hosts(['scc-na1'])['scc-na1']
+    assert host.name == 'scc-na1.scc.bu.edu'
+    assert host.num_proc == 28
+    assert host.mem_total == 257844.320312
+    assert host.load_values['np_load_avg'] == '0.5'
+    assert host.complex_values == {'h_vmem': '125G',
+                                   'cpu_arch': 'broadwell'}
+
+
+def test_get_hosts_matches_fqdn_exactly(fake_sge):
+    # qconf may return both hosts for either name; scc-na1 must not match
+    # scc-na10
+    both = (HOST.format('scc-na10.scc.bu.edu') +
+            HOST.format('scc-na1.scc.bu.edu').replace('28', '16'))
+    fake_sge.add_host('scc-na1', both)
+    fake_sge.add_host('scc-na10', '')
+    fake_sge.add_host('scc-na2.scc.bu.edu', HOST.format('scc-na2.scc.bu.edu'))
+    hosts = get_hosts(['scc-na1', 'scc-na10', 'scc-na2.scc.bu.edu',
+                       'unknown'])
+    assert hosts['scc-na1'].num_proc == 16
+    assert hosts['scc-na10'].num_proc == 28
+    assert hosts['scc-na2.scc.bu.edu'].name == 'scc-na2.scc.bu.edu'
+    assert 'unknown' not in hosts
+
+
+def test_one_call_per_poll(fake_sge):
+    fake_sge.set_jobs([(1, 'r')])
+    for _ in range(10):
+        assert running_jobs_names('me') == ['job_1']
+    assert len(fake_sge.calls('qstat')) == 1
+    nodes = ['node{}'.format(i) for i in range(5)]
+    for node in nodes + ['node5']:
+        fake_sge.add_host(node, HOST.format(node))
+    assert sorted(get_hosts(nodes + nodes[:2])) == nodes
+    assert get_hosts(nodes[:3]).keys() == set(nodes[:3])
+    get_hosts(['node0', 'node5'])
+    assert fake_sge.calls('qconf') == [
+        'qconf -se node0,node1,node2,node3,node4', 'qconf -se node5']
+
+
+def test_ttl_expiry(fake_sge, monkeypatch):
+    now = [1000.]
+    monkeypatch.setattr(job_tools.time, 'time', lambda: now[0])
+    fake_sge.add_host('node0', HOST.format('node0'))
+    get_jobs('me')
+    get_hosts(['node0'])
+    now[0] += job_tools.QSTAT_TTL - 1
+    get_jobs('me')
+    assert len(fake_sge.calls('qstat')) == 1
+    now[0] += 2
+    get_jobs('me')
+    get_hosts(['node0'])
+    assert len(fake_sge.calls('qstat')) == 2
+    assert len(fake_sge.calls('qconf')) == 1
+    now[0] += job_tools.QCONF_TTL
+    get_hosts(['node0'])
+    assert len(fake_sge.calls('qconf')) == 2
+    get_jobs('me', max_age=0)
+    get_hosts(['node0'], max_age=0)
+    assert len(fake_sge.calls('qstat')) == 3
+    assert len(fake_sge.calls('qconf')) == 3
+
+
+def test_clear_scheduler_cache(fake_sge):
+    fake_sge.set_jobs([(1, 'r')])
+    assert running_jobs_names('me') == ['job_1']
+    fake_sge.set_jobs([(2, 'r')])
+    assert running_jobs_names('me') == ['job_1']
+    clear_scheduler_cache()
+    assert running_jobs_names('me') == ['job_2']
+
+
+def test_slow_qstat_does_not_block_get_hosts(fake_sge):
+    fake_sge.add_host('node0', HOST.format('node0'))
+    fake_sge.set_delay('qstat', 1)
+    thread = threading.Thread(target=get_jobs, args=('me',))
+    thread.start()
+    try:
+        time.sleep(0.2)  # let qstat start
+        start = time.time()
+        assert 'node0' in get_hosts(['node0'])
+        assert time.time() - start < 0.5
+    finally:
+        thread.join()
+
+
+def test_concurrent_polls_share_one_query(fake_sge):
+    fake_sge.set_delay('qstat', 0.3)
+    threads = [threading.Thread(target=get_jobs, args=('me',))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(fake_sge.calls('qstat')) == 1
+
+
+def test_qstat_failure_keeps_its_error(fake_sge):
+    fake_sge.set_xml('')
+    fake_sge.set_failure('error: unable to contact qmaster\n', 1)
+    with pytest.raises(subprocess.CalledProcessError) as info:
+        running_jobs_names('me')
+    assert info.value.returncode == 1
+    assert 'unable to contact qmaster' in info.value.stderr
+
+
+def test_unparsable_output_raises_parse_error(fake_sge):
+    fake_sge.set_xml('')
+    with pytest.raises(ElementTree.ParseError):
+        running_jobs_names('me')
+
+
+def test_chatty_stderr_does_not_block(fake_sge):
+    fake_sge.set_jobs([(1, 'r')])
+    fake_sge.set_failure('warning: something\n' * 50000, 0)
+    result = []
+    thread = threading.Thread(
+        target=lambda: result.append(running_jobs_names('me')), daemon=True)
+    thread.start()
+    thread.join(10.)
+    assert result == [['job_1']]
@@ -0,0 +1,69 @@
+import os
+import time
+
+from thtools import clean_compute_node
+from thtools.clean_compute_node import ScratchIndex
+
+
+def touch(path, mtime=None):
+    open(path, 'w').close()
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def make_index(tmp_path):
+    return ScratchIndex(str(tmp_path / 'index.sqlite'))
+
+
+def test_refresh_and_entries(tmp_path):
+    root = tmp_path / 'scratch'
+    (root / 'old').mkdir(parents=True)
+    old = time.time() - 10 * 86400
+    touch(str(root / 'old' / 'f'), old)
+    touch(str(root / 'new'))
+    os.utime(str(root / 'old'), (old, old))
+    with make_index(tmp_path) as index:
+        assert index.refresh(str(root)) == 2
+        entries = index.entries(str(root), time.time() - 86400)
+        assert [(e.name, e.is_dir) for e in entries] == [
+            (os.path.join('old', 'f'), False), ('old', True)]
+        assert entries[1].mtime == old
+        assert [row[1] for row in index.oldest(1)] == [
+            str(root / 'old' / 'f')]
+
+
+def test_file_added_in_same_mtime_tick(tmp_path):
+    root = tmp_path / 'scratch'
+    root.mkdir()
+    touch(str(root / 'a'))
+    with make_index(tmp_path) as index:
+        index.refresh(str(root))
+        # a coarse mtime (e.g. on NFS) does not change for a file created
+        # right after the listing
+        st = os.stat(str(root))
+        touch(str(root / 'b'))
+        os.utime(str(root), ns=(st.st_atime_ns, st.st_mtime_ns))
+        index.refresh(str(root))
+        assert sorted(row[1] for row in index.largest()) == [
+            str(root / 'a'), str(root / 'b')]
+
+
+def test_unreadable_directory_is_skipped(tmp_path, monkeypatch):
+    root = tmp_path / 'scratch'
+    (root / 'blocked').mkdir(parents=True)
+    touch(str(root / 'blocked' / 'f'))
+    touch(str(root / 'g'))
+    blocked = str(root / 'blocked')
+    scandir = os.scandir
+
+    def fake_scandir(path):
+        if path == blocked:
+            raise PermissionError(13, 'Permission denied', path)
+        return scandir(path)
+
+    monkeypatch.setattr(clean_compute_node.os, 'scandir', fake_scandir)
+    errors = []
+    with make_index(tmp_path) as index:
+        index.refresh(str(root), onerror=errors.append)
+        assert [row[1] for row in index.largest()] == [str(root / 'g')]
+    assert [e.filename for e in errors] == [blocked]
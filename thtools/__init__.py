@@ -23,7 +23,61 @@
 
 from __future__ import absolute_import
 
-from .dirs import cd, resolve_path
-from .saving import make_obj_dir, save_obj, load_obj
-from .job_tools import run, get_node_mem, running_jobs_names
-from .dict_tools import merge_two_dicts
+import importlib
+
+# Public names and the submodules they come from. These are only imported
+# when first used, so e.g. `thtools.cd` does not pay for importing
+# subprocess, pickle or asyncio.
+_exports = {
+    'cd': 'dirs',
+    'resolve_path': 'dirs',
+    'PathResolver': 'dirs',
+    'local_cd': 'dirs',
+    'local_open': 'dirs',
+    'local_run': 'dirs',
+    'make_obj_dir': 'saving',
+    'save_obj': 'saving',
+    'load_obj': 'saving',
+    'disk_cache': 'saving',
+    'AsyncSaver': 'saving',
+    'RecordWriter': 'saving',
+    'RecordReader': 'saving',
+    'iter_records': 'saving',
+    'save_many': 'saving',
+    'load_many': 'saving',
+    'iter_load': 'saving',
+    'run': 'job_tools',
+    'arun': 'job_tools',
+    'run_many': 'job_tools',
+    'get_node_mem': 'job_tools',
+    'running_jobs_names': 'job_tools',
+    'get_jobs': 'job_tools',
+    'get_hosts': 'job_tools',
+    'probe_node_resources': 'job_tools',
+    'JobWatcher': 'job_tools',
+    'merge_two_dicts': 'dict_tools',
+    'merge_dicts': 'dict_tools',
+    'LayeredDict': 'dict_tools',
+}
+_submodules = {'clean_compute_node', 'dict_tools', 'dirs', 'instrumentation',
+               'job_tools', 'saving'}
+
+__all__ = sorted(_exports)
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    try:
+        module_name = _exports[name]
+    except KeyError:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(
+            __name__, name))
+    value = getattr(importlib.import_module('.' + module_name, __name__),
+                    name)
+    globals()[name] = value  # later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports) | _submodules)
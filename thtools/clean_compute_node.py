@@ -26,10 +26,14 @@ Tools to cleanup scratch space on compute nodes
 #                                                                      #
 ########################################################################
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 import datetime
+import errno
 import getpass
 import os
+import queue
+import threading
+import time
 try:
     from pathlib import Path
     Path().expanduser()
@@ -40,8 +44,9 @@ except (ImportError, AttributeError):
         raise ImportError('Could not find the required pathlib/pathlib2\n'
                           'Try using Python >= 2.6')
 try:
-    from thtools import cd
+    from thtools import cd, instrumentation
 except ImportError:
+    instrumentation = None
     from contextlib import contextmanager
 
     @contextmanager
@@ -59,13 +64,20 @@ dict_node = {3: '/net/scc-{}',
              7: '/net/{}',
              12: '{}'}
 
+ScanEntry = namedtuple('ScanEntry', ['path', 'name', 'is_dir', 'size',
+                                     'mtime'])
+NodeSummary = namedtuple('NodeSummary', ['node', 'paths', 'files', 'n_files',
+                                         'n_bytes', 'oldest_age', 'error',
+                                         'skipped'])
 
-def clean_node(node, print_list=True, rm='ask', subfolder=None, older_than=0):
+
+def clean_node(node, print_list=True, rm='ask', subfolder=None, older_than=0,
+               index=None):
     """
     Clean out scratch folder on a compute node.
 
-    Note, this will not work with directories in the scratch folder. That
-    will raise OSError.
+    Subdirectories are searched too, and directories left empty by the
+    deletion are removed (see :func:`scan_tree`).
     :param str node: Designation of the node on which to work.
         This accepts three different formats. For the node at
         '/net/scc-na1', any of the following will work: 'na1', 'scc-na1',
@@ -86,36 +98,36 @@ def clean_node(node, print_list=True, rm='ask', subfolder=None, older_than=0):
         getpass.getuser() and that will be used as the subfolder.
     :param int older_than: Default: 0. This gives the minimum age for files
         to list/delete.
+    :param ScratchIndex index: Default: None. If given, the files are found
+        from this index (after refreshing it) instead of a full traversal.
     :return: None
     """
-    try:
-        _node = dict_node[len(node)].format(node)
-    except KeyError:
-        raise ValueError('Unable to parse node input "{}".\n Examples: "na1" |'
-                         '"scc-na1" | "/net/scc-na1"')
-    _subfolder = getpass.getuser() if subfolder is None else subfolder
-    path = Path('{}/scratch/{}'.format(_node, _subfolder))
-    if path.is_dir():
-        paths = [path]
-    else:
-        p = path.parent
-        paths = list(p.glob(_subfolder))
-        if not paths:
-            print('No folder: {}'.format(path))
-            return None
+    paths = _node_paths(node, subfolder)
+    if not paths:
+        return None
     if isinstance(rm, bool):
         _rm = rm
     else:
         _rm = rm.lower()
+    cutoff = _age_cutoff(older_than)
     for path in paths:
-        files = list(path.glob('*'))
-        files = [f for f in files if is_older_than(f, older_than)]
-        if len(files) == 0:
+        if index is not None:
+            index.refresh(path, node, onerror=_print_skipped)
+            files = index.entries(path, cutoff)
+        elif _rm is True and not print_list:
+            # nothing to show or ask, so delete as the folder is scanned
+            remove_entries(scan_tree(path, cutoff=cutoff,
+                                     onerror=_print_skipped))
+            continue
+        else:
+            files = list(scan_tree(path, cutoff=cutoff,
+                                   onerror=_print_skipped))
+        if not any(not f.is_dir for f in files):
             print('No files in {}'.format(path))
             continue
         if print_list:
-            print('The files in {} are:\n {}'.format(path, [f.name for f in
-                                                            files]))
+            print('The files in {} are:\n {}'.format(
+                path, [f.name for f in files if not f.is_dir]))
         response = False
         dict_response = defaultdict(lambda: False, y=True)
         if _rm is False:
@@ -124,12 +136,471 @@ def clean_node(node, print_list=True, rm='ask', subfolder=None, older_than=0):
             response = dict_response[input('Delete all files in '
                                            '{}? [yn]: '.format(path))]
         if response is True or _rm is True:
-            for f in files:
-                f.unlink()
+            if index is None:
+                remove_entries(files)
+            else:
+                # the index may have missed files modified in place
+                remove_entries(files, cutoff=cutoff)
+                index.refresh(path, node, onerror=_print_skipped)
         else:
             print('No files removed from "{}".'.format(path))
 
 
+def scan_node(node, subfolder=None, older_than=0):
+    """
+    List the files in the scratch folder on a node without deleting them
+
+    :param str node: Designation of the node (see :func:`clean_node`)
+    :param str subfolder: Default: None. Subfolder of scratch directory in
+        which to look. If None, the user's username is used.
+    :param int older_than: Default: 0. Minimum age (in days) of the files
+        to list.
+    :return: Summary of the files found; its `files` are the ScanEntries
+        from :func:`scan_tree` (including directories that could be removed
+        afterwards), `oldest_age` is in days (None if there are no files),
+        and `skipped` has the errors for entries that could not be read.
+    :rtype: NodeSummary
+    """
+    paths = _node_paths(node, subfolder, verbose=False)
+    cutoff = _age_cutoff(older_than)
+    files = []
+    skipped = []
+    n_files = 0
+    n_bytes = 0
+    oldest = None
+    for path in paths:
+        for entry in scan_tree(path, cutoff=cutoff, onerror=skipped.append):
+            files.append(entry)
+            if entry.is_dir:
+                continue
+            n_files += 1
+            n_bytes += entry.size
+            if oldest is None or entry.mtime < oldest:
+                oldest = entry.mtime
+    oldest_age = None if oldest is None else (time.time() - oldest) / 86400.
+    return NodeSummary(node=node, paths=paths, files=files,
+                       n_files=n_files, n_bytes=n_bytes,
+                       oldest_age=oldest_age, error=None, skipped=skipped)
+
+
+def sweep_nodes(nodes, subfolder=None, older_than=0, max_workers=8,
+                timeout=60.):
+    """
+    Scan the scratch folders on several nodes concurrently
+
+    Each node is scanned with :func:`scan_node` on its own thread, with up
+    to `max_workers` at once. A node that takes longer than `timeout`
+    seconds (e.g., a hung automount) is abandoned and reported with an
+    error instead of stalling the rest of the sweep.
+
+    :param list(str) nodes: Designations of the nodes
+    :param str subfolder: Default: None. Subfolder of scratch directory in
+        which to look. If None, the user's username is used.
+    :param int older_than: Default: 0. Minimum age (in days) of the files
+        to list.
+    :param int max_workers: Default: 8. Number of nodes scanned at once.
+    :param float timeout: Default: 60. Seconds to wait for each node.
+    :return: Summaries of the nodes, in the same order as `nodes`. Nodes
+        that failed or timed out have `error` set.
+    :rtype: list(NodeSummary)
+    """
+    def scan(node):
+        return scan_node(node, subfolder=subfolder, older_than=older_than)
+
+    results = _map_with_timeout(scan, nodes, max_workers, timeout)
+    summaries = []
+    for node, (result, error) in zip(nodes, results):
+        if error is not None:
+            result = NodeSummary(node=node, paths=[], files=[], n_files=0,
+                                 n_bytes=0, oldest_age=None, error=error,
+                                 skipped=[])
+        summaries.append(result)
+    return summaries
+
+
+def clean_nodes(nodes, print_list=True, rm='ask', subfolder=None,
+                older_than=0, max_workers=8, timeout=60.):
+    """
+    Clean out scratch folders on several nodes, scanning them in parallel
+
+    The nodes are scanned with :func:`sweep_nodes`, a summary is printed
+    for each, and then (if `rm` is 'ask') the user is asked once whether to
+    delete all the files found.
+
+    See :func:`clean_node` and :func:`sweep_nodes` for the parameters.
+
+    :return: The summaries of the nodes
+    :rtype: list(NodeSummary)
+    """
+    summaries = sweep_nodes(nodes, subfolder=subfolder,
+                            older_than=older_than, max_workers=max_workers,
+                            timeout=timeout)
+    for summary in summaries:
+        if summary.error is not None:
+            print('{}: {}'.format(summary.node, summary.error))
+            continue
+        for error in summary.skipped:
+            _print_skipped(error)
+        if summary.n_files == 0:
+            print('{}: no files'.format(summary.node))
+            continue
+        print('{}: {} files, {:.1f} MB, oldest {:.1f} days'.format(
+            summary.node, summary.n_files, summary.n_bytes / 1e6,
+            summary.oldest_age))
+        if print_list:
+            print(' {}'.format([f.name for f in summary.files
+                                if not f.is_dir]))
+    n_files = sum(summary.n_files for summary in summaries)
+    _rm = rm if isinstance(rm, bool) else rm.lower()
+    if n_files == 0 or _rm is False:
+        return summaries
+    if _rm == 'ask':
+        response = input('Delete all {} files on {} nodes? [yn]: '.format(
+            n_files, sum(1 for summary in summaries if summary.n_files)))
+        if response != 'y':
+            print('No files removed.')
+            return summaries
+    elif _rm is not True:
+        return summaries
+    for summary in summaries:
+        remove_entries(summary.files)
+    return summaries
+
+
+def scan_tree(root, older_than=0, cutoff=None, onerror=None):
+    """
+    Lazily walk `root` and yield the files last modified before a cutoff
+
+    This uses os.scandir, so each entry is stat'ed only once, and yields
+    entries as it goes, so memory use does not grow with the number of
+    files. Symbolic links are yielded as files and never followed.
+
+    Each directory (other than `root`) that was itself last modified before
+    the cutoff is yielded after everything in it, so passing the entries in
+    order to :func:`remove_entries` deletes bottom-up and removes the
+    directories that end up empty.
+
+    Entries removed while the scan is running are skipped. So are entries
+    (and whole subdirectories) that cannot be read, e.g. because of their
+    permissions; these are reported to `onerror`.
+
+    :param str root: The directory to walk
+    :param float older_than: Default: 0. Minimum age in days of the entries
+        to yield.
+    :param float cutoff: Default: None. Instead of `older_than`, the epoch
+        time before which entries must have been modified.
+    :param onerror: Default: None. Function called with the OSError for
+        each entry skipped because it could not be read (other than
+        FileNotFoundError). If None, these are skipped silently.
+    :return: Generator of the matching entries
+    :rtype: generator(ScanEntry)
+    """
+    if cutoff is None:
+        cutoff = _age_cutoff(older_than)
+    root = os.fspath(root)
+    start = len(os.path.join(root, ''))
+    timed = _instrumenting()
+    n_dirs = 1
+    # stack of (open scandir iterator, the directory's own entry)
+    stack = [(os.scandir(root), None)]
+    try:
+        while stack:
+            it, dir_entry = stack[-1]
+            for entry in it:
+                try:
+                    if timed:
+                        t0 = time.perf_counter()
+                        st = entry.stat(follow_symlinks=False)
+                        instrumentation.add_time('clean.stat',
+                                                 time.perf_counter() - t0)
+                    else:
+                        st = entry.stat(follow_symlinks=False)
+                    sub_it = None
+                    if entry.is_dir(follow_symlinks=False):
+                        sub_it = os.scandir(entry.path)
+                except FileNotFoundError:
+                    continue  # removed since its directory was listed
+                except OSError as e:
+                    if onerror is not None:
+                        onerror(e)
+                    continue
+                if sub_it is not None:
+                    stack.append((sub_it,
+                                  ScanEntry(entry.path, entry.path[start:],
+                                            True, st.st_size, st.st_mtime)))
+                    n_dirs += 1
+                    break
+                if st.st_mtime < cutoff:
+                    if timed:
+                        instrumentation.count('clean.matched_bytes',
+                                              st.st_size)
+                    yield ScanEntry(entry.path, entry.path[start:], False,
+                                    st.st_size, st.st_mtime)
+            else:
+                it.close()
+                stack.pop()
+                if dir_entry is not None and dir_entry.mtime < cutoff:
+                    yield dir_entry
+    finally:
+        for it, _ in stack:
+            it.close()
+        if timed:
+            instrumentation.count('clean.dirs_scanned', n_dirs)
+
+
+def remove_entries(entries, cutoff=None):
+    """
+    Delete the files and (empty) directories from :func:`scan_tree`
+
+    Directories that are not empty, because they still hold newer files,
+    are left in place.
+
+    :param entries: Iterable of ScanEntries, in the order given by
+        :func:`scan_tree`
+    :param float cutoff: Default: None. If given, each file is stat'ed
+        again first and only deleted if it was still last modified before
+        this epoch time (for entries that may be out of date).
+    :return: The number of files and directories removed
+    :rtype: int
+    """
+    timed = _instrumenting()
+    n = 0
+    for entry in entries:
+        if timed:
+            t0 = time.perf_counter()
+        try:
+            if entry.is_dir:
+                os.rmdir(entry.path)
+            elif (cutoff is not None and
+                  os.lstat(entry.path).st_mtime >= cutoff):
+                continue
+            else:
+                os.unlink(entry.path)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            if entry.is_dir and e.errno in (errno.ENOTEMPTY, errno.EEXIST):
+                continue
+            raise
+        n += 1
+        if timed:
+            instrumentation.add_time(
+                'clean.rmdir' if entry.is_dir else 'clean.unlink',
+                time.perf_counter() - t0)
+            if not entry.is_dir:
+                instrumentation.count('clean.removed_bytes', entry.size)
+    return n
+
+
+class ScratchIndex(object):
+    """
+    Persistent sqlite index of the files in scratch folders
+
+    The index records the path, size and mtime of each file, and the mtime
+    of each directory. :meth:`refresh` only re-lists directories whose mtime
+    changed since they were last indexed (any file created, deleted or
+    renamed in a directory changes its mtime), so after the first run it
+    costs one stat per directory rather than one per file. Files that are
+    modified in place do not change their directory's mtime, so sizes and
+    mtimes in the index can lag behind; deletions based on the index
+    re-check each file's age first. A directory listed within a second of
+    its last change is listed again on the next refresh, because a file
+    created in the same (coarse, e.g. on NFS) mtime tick would not change
+    the mtime.
+
+    :param str db_path: Default: ~/.thtools/scratch_index.sqlite. Location
+        of the sqlite database, which is created if needed.
+    """
+
+    default_path = os.path.join('~', '.thtools', 'scratch_index.sqlite')
+
+    def __init__(self, db_path=None):
+        import sqlite3
+        self.db_path = os.path.expanduser(db_path or self.default_path)
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(self.db_path)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY, parent TEXT, node TEXT, root TEXT,
+                mtime REAL);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, dir TEXT, node TEXT, root TEXT,
+                size INTEGER, mtime REAL);
+            CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+            CREATE INDEX IF NOT EXISTS files_root ON files (root, mtime);
+            CREATE INDEX IF NOT EXISTS files_size ON files (node, size);
+            CREATE INDEX IF NOT EXISTS files_mtime ON files (node, mtime);
+        ''')
+
+    def refresh(self, root, node=None, onerror=None):
+        """
+        Bring the index of `root` up to date
+
+        Directories (and files) that cannot be read, e.g. because of their
+        permissions, are skipped and left out of the index, as by
+        :func:`scan_tree`.
+
+        :param str root: Scratch folder to index
+        :param str node: Default: None. Node designation recorded with the
+            files, for the `nodes` argument of the queries. If None, `root`
+            is used.
+        :param onerror: Default: None. Function called with the OSError for
+            each directory or file skipped because it could not be read.
+        :return: The number of directories that were re-listed
+        :rtype: int
+        """
+        root = os.fspath(root)
+        node = root if node is None else node
+        n_listed = 0
+        stack = [root]
+        with self._db:
+            while stack:
+                d = stack.pop()
+                try:
+                    mtime = os.stat(d).st_mtime
+                except FileNotFoundError:
+                    self._forget_dir(d)
+                    continue
+                except OSError as e:
+                    self._skip_dir(d, e, onerror)
+                    continue
+                row = self._db.execute('SELECT mtime FROM dirs WHERE path=?',
+                                       (d,)).fetchone()
+                if row is not None and row[0] == mtime:
+                    stack.extend(p for (p,) in self._db.execute(
+                        'SELECT path FROM dirs WHERE parent=?', (d,)))
+                    continue
+                try:
+                    stack.extend(self._relist(d, mtime, node, root, onerror))
+                except FileNotFoundError:
+                    self._forget_dir(d)
+                    continue
+                except OSError as e:
+                    self._skip_dir(d, e, onerror)
+                    continue
+                n_listed += 1
+        return n_listed
+
+    def _relist(self, d, mtime, node, root, onerror=None):
+        """Re-index the contents of directory `d`; return its subdirs"""
+        files, subdirs = [], []
+        listed = time.time()
+        with os.scandir(d) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    if onerror is not None:
+                        onerror(e)
+                    continue
+                files.append((entry.path, d, node, root, st.st_size,
+                              st.st_mtime))
+        self._db.execute('DELETE FROM files WHERE dir=?', (d,))
+        self._db.executemany('INSERT OR REPLACE INTO files VALUES '
+                             '(?, ?, ?, ?, ?, ?)', files)
+        subdir_set = set(subdirs)
+        for (old,) in self._db.execute('SELECT path FROM dirs WHERE parent=?',
+                                       (d,)).fetchall():
+            if old not in subdir_set:
+                self._forget_dir(old)
+        parent = None if d == root else os.path.dirname(d)
+        if listed - mtime < 1.:
+            # the directory could change again within the resolution of its
+            # mtime; store the mtime negated, so it never matches and the
+            # directory is listed again next time
+            mtime = -mtime
+        self._db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?)',
+                         (d, parent, node, root, mtime))
+        return subdirs
+
+    def _skip_dir(self, d, error, onerror=None):
+        """Leave unreadable directory `d` out of the index"""
+        self._forget_dir(d)
+        if onerror is not None:
+            onerror(error)
+
+    def _forget_dir(self, d):
+        """Remove directory `d` and everything under it from the index"""
+        prefix = os.path.join(d, '')
+        for table in ('dirs', 'files'):
+            self._db.execute('DELETE FROM {} WHERE path=? OR '
+                             'substr(path, 1, ?)=?'.format(table),
+                             (d, len(prefix), prefix))
+
+    def entries(self, root, cutoff):
+        """
+        The indexed files and directories in `root` modified before `cutoff`
+
+        :param str root: Scratch folder (as given to :meth:`refresh`)
+        :param float cutoff: Epoch time
+        :return: The files, then the directories deepest first, in an
+            order suitable for :func:`remove_entries`
+        :rtype: list(ScanEntry)
+        """
+        root = os.fspath(root)
+        start = len(os.path.join(root, ''))
+        files = [ScanEntry(path, path[start:], False, size, mtime)
+                 for path, size, mtime in self._db.execute(
+                     'SELECT path, size, mtime FROM files '
+                     'WHERE root=? AND mtime<? ORDER BY path', (root, cutoff))]
+        dirs = [ScanEntry(path, path[start:], True, 0, mtime)
+                for path, mtime in self._db.execute(
+                    'SELECT path, abs(mtime) FROM dirs '
+                    'WHERE root=? AND path!=? AND abs(mtime)<?',
+                    (root, root, cutoff))]
+        dirs.sort(key=lambda e: e.path.count(os.sep), reverse=True)
+        return files + dirs
+
+    def largest(self, n=10, nodes=None):
+        """
+        The `n` largest indexed files
+
+        :param int n: Default: 10. Number of files to return
+        :param list(str) nodes: Default: None. Only consider files on these
+            nodes (as given to :meth:`refresh`); None for all.
+        :return: (node, path, size, mtime) tuples, largest first
+        :rtype: list(tuple)
+        """
+        return self._query('size DESC', n, nodes)
+
+    def oldest(self, n=10, nodes=None):
+        """
+        The `n` least recently modified indexed files
+
+        See :meth:`largest` for the parameters.
+
+        :return: (node, path, size, mtime) tuples, oldest first
+        :rtype: list(tuple)
+        """
+        return self._query('mtime ASC', n, nodes)
+
+    def _query(self, order, n, nodes):
+        sql = 'SELECT node, path, size, mtime FROM files'
+        args = []
+        if nodes is not None:
+            nodes = list(nodes)
+            sql += ' WHERE node IN ({})'.format(', '.join('?' * len(nodes)))
+            args += nodes
+        sql += ' ORDER BY {} LIMIT ?'.format(order)
+        args.append(n)
+        return self._db.execute(sql, args).fetchall()
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 def is_older_than(file, days):
     """
     Test if `file` was last modified more than `days` ago
@@ -139,9 +610,88 @@ def is_older_than(file, days):
     :return: Whether the file is older than days
     :rtype: bool
     """
-    min_age = datetime.timedelta(days=days)
-    mtime = datetime.datetime.fromtimestamp(file.stat().st_mtime)
-    return min_age > mtime - datetime.datetime.now()
+    return file.stat().st_mtime < _age_cutoff(days)
+
+
+def _print_skipped(error):
+    print('Skipped {}: {}'.format(error.filename, error.strerror))
+
+
+def _instrumenting():
+    """Whether to report to :mod:`thtools.instrumentation`"""
+    return instrumentation is not None and instrumentation.enabled()
+
+
+def _age_cutoff(days):
+    """Epoch time `days` days ago"""
+    return time.time() - days * 86400.
+
+
+def _node_paths(node, subfolder=None, verbose=True):
+    """
+    Find the scratch folder(s) for `subfolder` on `node`
+
+    :return: The matching folders; empty if there are none
+    :rtype: list(pathlib.Path)
+    """
+    try:
+        _node = dict_node[len(node)].format(node)
+    except KeyError:
+        raise ValueError('Unable to parse node input "{}".\n Examples: "na1" |'
+                         '"scc-na1" | "/net/scc-na1"'.format(node))
+    _subfolder = getpass.getuser() if subfolder is None else subfolder
+    path = Path('{}/scratch/{}'.format(_node, _subfolder))
+    if path.is_dir():
+        return [path]
+    paths = list(path.parent.glob(_subfolder))
+    if not paths and verbose:
+        print('No folder: {}'.format(path))
+    return paths
+
+
+def _map_with_timeout(func, items, max_workers, timeout):
+    """
+    Call `func` on each of `items` on up to `max_workers` threads
+
+    Unlike concurrent.futures, calls that take longer than `timeout`
+    seconds are abandoned: they run on daemon threads, so even one stuck in
+    an uninterruptible filesystem call cannot keep the interpreter from
+    exiting.
+
+    :return: A (result, error) pair for each item, in order. `error` is
+        None on success, otherwise a string describing what went wrong.
+    """
+    results = [(None, 'not scanned')] * len(items)
+    done = queue.Queue()
+    running = {}  # index: deadline
+    pending = list(range(len(items)))[::-1]
+
+    def call(i):
+        try:
+            done.put((i, func(items[i]), None))
+        except Exception as e:
+            done.put((i, None, '{}: {}'.format(type(e).__name__, e)))
+
+    while pending or running:
+        while pending and len(running) < max_workers:
+            i = pending.pop()
+            running[i] = time.time() + timeout
+            threading.Thread(target=call, args=(i,), daemon=True).start()
+        wait = max(0., min(running.values()) - time.time())
+        try:
+            i, result, error = done.get(timeout=wait)
+        except queue.Empty:
+            now = time.time()
+            for i, deadline in list(running.items()):
+                if deadline <= now:
+                    del running[i]
+                    results[i] = (None, 'timed out after {} s'.format(
+                        timeout))
+            continue
+        if i in running:  # not already given up on
+            del running[i]
+            results[i] = (result, error)
+    return results
 
 
 if __name__ == '__main__':
@@ -169,6 +719,25 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--days_old', type=int, default=0,
                         help='Min age (in days) for which files will be listed '
                              'or removed')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of nodes to scan in parallel. If more '
+                             'than 1, all nodes are scanned first and there '
+                             'is a single confirmation for all of them')
+    parser.add_argument('-t', '--timeout', type=float, default=60.,
+                        help='With --jobs, seconds to wait for each node '
+                             'before giving up on it')
+    parser.add_argument('-i', '--index', nargs='?', const='', default=None,
+                        help='Use (and update) a persistent index of the '
+                             'scratch folders to avoid full traversals. '
+                             'Optionally give the path of the index '
+                             'database; defaults to {}. Not used with '
+                             '--jobs'.format(
+                                 ScratchIndex.default_path))
+    parser.add_argument('-r', '--report', choices=['largest', 'oldest'],
+                        help='Only refresh the index and report the largest '
+                             'or oldest files on the nodes')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of files to show with --report')
     args = parser.parse_args()
     if args.ask or not (args.delete or args.ask or args.list_only):
         a_rm = 'ask'
@@ -178,10 +747,28 @@ if __name__ == '__main__':
         a_rm = False
     _print = False if args.no_print else True
     a_subfolder = args.folder if args.folder else None
-    for a_node in args.nodes:
-        try:
-            clean_node(a_node, print_list=_print, rm=a_rm,
-                       subfolder=a_subfolder)
-        except ValueError as e:
-            print(e)
-            print('continuing with rest...')
+    a_index = None
+    if args.index is not None or args.report:
+        a_index = ScratchIndex(args.index or None)
+    if args.report:
+        for a_node in args.nodes:
+            for a_path in _node_paths(a_node, a_subfolder):
+                a_index.refresh(a_path, a_node, onerror=_print_skipped)
+        report = getattr(a_index, args.report)(args.top, nodes=args.nodes)
+        for a_node, a_path, size, mtime in report:
+            print('{:>12,d}  {}  {}'.format(
+                size, datetime.datetime.fromtimestamp(mtime).strftime(
+                    '%Y-%m-%d %H:%M'), a_path))
+    elif args.jobs > 1:
+        clean_nodes(args.nodes, print_list=_print, rm=a_rm,
+                    subfolder=a_subfolder, older_than=args.days_old,
+                    max_workers=args.jobs, timeout=args.timeout)
+    else:
+        for a_node in args.nodes:
+            try:
+                clean_node(a_node, print_list=_print, rm=a_rm,
+                           subfolder=a_subfolder, older_than=args.days_old,
+                           index=a_index)
+            except ValueError as e:
+                print(e)
+                print('continuing with rest...')
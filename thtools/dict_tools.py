@@ -26,9 +26,158 @@ Functions helpful for using dictionaries
 #                                                                      #
 ########################################################################
 
+from collections.abc import Mapping
+
 
 def merge_two_dicts(x, y):
     """Given two dicts, merge them into a new dict as a shallow copy."""
     z = x.copy()
     z.update(y)
     return z
+
+
+def merge_dicts(*dicts, deep=True, strategy='override', lists='replace'):
+    """
+    Merge any number of mappings into a new dict in one pass
+
+    Later mappings take precedence over earlier ones (by default). Only the
+    dicts that actually need merging are created: values (including nested
+    dicts) that come from a single input are put into the result as-is, not
+    copied, so they are shared with the inputs.
+
+    :param dicts: The mappings to merge, lowest precedence first
+    :param bool deep: Default: True. If True, nested mappings under the
+        same key are merged recursively. Otherwise they are treated like
+        any other value.
+    :param strategy: Default: 'override'. What to do when two inputs have
+        different values for a key (that are not both merged):
+        'override' takes the later value, 'keep' the earlier one, and
+        'error' raises ValueError. Can also be a function called as
+        strategy(key, old_value, new_value) that returns the value to use.
+    :param str lists: Default: 'replace'. How to combine two lists under
+        the same key: 'replace' them (as with any other value, according to
+        `strategy`), 'extend' the earlier with the later, or 'unique' to
+        extend with only the items not already present.
+    :return: The merged dict
+    :rtype: dict
+    """
+    if lists not in ('replace', 'extend', 'unique'):
+        raise ValueError('Unknown lists option: {}'.format(lists))
+    if not deep and strategy == 'override' and lists == 'replace':
+        result = {}
+        for d in dicts:
+            result.update(d)
+        return result
+    return _merge(dicts, deep, _conflict_resolver(strategy), lists)
+
+
+def _merge(dicts, deep, resolve, lists):
+    result = {}
+    nested = {}  # key: mappings under it to be merged
+    own_lists = set()  # keys whose lists were created here
+    for d in dicts:
+        for key, value in d.items():
+            if key not in result:
+                result[key] = value
+                continue
+            old = result[key]
+            if deep and isinstance(value, Mapping) and isinstance(old,
+                                                                  Mapping):
+                nested.setdefault(key, [old]).append(value)
+                continue
+            if (lists != 'replace' and isinstance(old, list) and
+                    isinstance(value, list)):
+                if key not in own_lists:
+                    old = result[key] = list(old)
+                    own_lists.add(key)
+                if lists == 'extend':
+                    old.extend(value)
+                else:
+                    old.extend(item for item in value if item not in old)
+                continue
+            new = resolve(key, old, value)
+            if new is not old:
+                nested.pop(key, None)
+                own_lists.discard(key)
+            result[key] = new
+    for key, group in nested.items():
+        result[key] = _merge(group, deep, resolve, lists)
+    return result
+
+
+def _conflict_resolver(strategy):
+    if callable(strategy):
+        return strategy
+    if strategy == 'override':
+        return lambda key, old, new: new
+    if strategy == 'keep':
+        return lambda key, old, new: old
+    if strategy == 'error':
+        def resolve(key, old, new):
+            if old != new:
+                raise ValueError('Conflicting values for {!r}: {!r} and '
+                                 '{!r}'.format(key, old, new))
+            return old
+        return resolve
+    raise ValueError('Unknown strategy: {}'.format(strategy))
+
+
+class LayeredDict(Mapping):
+    """
+    Read-only view of several mappings layered on top of each other
+
+    Like collections.ChainMap, but the last mapping given has the highest
+    precedence, and (if `deep`) nested mappings under the same key are
+    themselves viewed as a LayeredDict instead of hiding each other.
+    Nothing is copied or merged until :meth:`to_dict` is called, so
+    building a view is cheap however many layers there are; each lookup
+    costs one check per layer instead.
+
+    Conflicts are resolved as by :func:`merge_dicts` with the default
+    'override' strategy and 'replace' for lists.
+
+    :param layers: The mappings, lowest precedence first
+    :param bool deep: Default: True. Whether nested mappings are layered.
+    """
+
+    def __init__(self, *layers, deep=True):
+        self.layers = layers
+        self.deep = deep
+
+    def __getitem__(self, key):
+        values = []
+        for layer in reversed(self.layers):
+            if key not in layer:
+                continue
+            value = layer[key]
+            if not (self.deep and isinstance(value, Mapping)):
+                if not values:
+                    return value
+                break  # hidden by the mappings above it
+            values.append(value)
+        if not values:
+            raise KeyError(key)
+        return LayeredDict(*reversed(values), deep=self.deep)
+
+    def __contains__(self, key):
+        return any(key in layer for layer in self.layers)
+
+    def __iter__(self):
+        seen = set()
+        for layer in self.layers:
+            for key in layer:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self):
+        return len(set().union(*self.layers))
+
+    def to_dict(self):
+        """Merge the layers into a new dict (see :func:`merge_dicts`)"""
+        return merge_dicts(*self.layers, deep=self.deep)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__,
+                               ', '.join(repr(layer) for layer in
+                                         self.layers))
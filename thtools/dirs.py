@@ -24,10 +24,37 @@ A context manager for changing directories
 #                                                                      #
 ########################################################################
 
+import contextvars
 import os
+import time
 from contextlib import contextmanager
 
 
+# (absolute path, _DirFd or None) of the local working directory
+_local_dir = contextvars.ContextVar('thtools_local_dir', default=None)
+
+
+class _DirFd(object):
+    """
+    An open directory file descriptor, closed once nothing refers to it
+
+    Tasks (and copied contexts) started inside :func:`local_cd` keep a
+    reference, so the descriptor stays valid, and its number is not reused
+    for another directory, for as long as any of them can still use it.
+    """
+
+    __slots__ = ('fd',)
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+
+    def __del__(self):
+        try:
+            os.close(self.fd)
+        except (AttributeError, OSError, TypeError):
+            pass  # never opened, or os is being torn down at exit
+
+
 @contextmanager
 def cd(new_dir, ignore_blank=False):
     prev_dir = os.getcwd()
@@ -39,6 +66,114 @@ def cd(new_dir, ignore_blank=False):
         os.chdir(prev_dir)
 
 
+@contextmanager
+def local_cd(new_dir, ignore_blank=False):
+    """
+    Like :func:`cd`, but only for the current thread or asyncio task
+
+    This never calls os.chdir. Instead it sets a context variable that the
+    local_* functions in this module resolve relative paths against (using
+    a file descriptor for the directory where the OS supports it, like
+    openat). Other threads and tasks are not affected, so directory-parallel
+    work can run on a thread pool or as concurrent tasks. Code that uses
+    plain relative paths, or os.getcwd, still sees the process-wide working
+    directory.
+
+    Note that new threads (including thread pool workers) start without a
+    local directory; enter local_cd in the function they run. Asyncio tasks
+    created inside the block keep its directory, even after the block
+    exits.
+
+    :param str new_dir: Directory to use, relative to the current local
+        directory (or the process working directory if there is none)
+    :param bool ignore_blank: Default: False. If True and `new_dir` is
+        empty, the local directory is left unchanged.
+    :return: Yields the absolute path of the local directory
+    """
+    if ignore_blank and not new_dir:
+        yield local_getcwd()
+        return
+    path = os.path.normpath(local_path(new_dir))
+    dir_fd = None
+    if os.open in os.supports_dir_fd:
+        dir_fd = _DirFd(path)
+    elif not os.path.isdir(path):
+        raise NotADirectoryError(path)
+    token = _local_dir.set((path, dir_fd))
+    try:
+        yield path
+    finally:
+        _local_dir.reset(token)
+
+
+def local_getcwd():
+    """The local directory set by :func:`local_cd`, or os.getcwd()"""
+    local = _local_dir.get()
+    return os.getcwd() if local is None else local[0]
+
+
+def local_path(path):
+    """
+    Absolute path of `path` relative to the local directory
+
+    :param str path: The path, which is user-expanded
+    :rtype: str
+    """
+    path = os.path.expanduser(path)
+    if os.path.isabs(path):
+        return path
+    return os.path.join(local_getcwd(), path)
+
+
+def local_open(file, mode='r', *args, **kwargs):
+    """
+    Like open, but relative paths are relative to the local directory
+
+    :return: The file object
+    """
+    local = _local_dir.get()
+    file = os.path.expanduser(file)
+    if local is None or os.path.isabs(file):
+        return open(file, mode, *args, **kwargs)
+    if local[1] is None:
+        return open(os.path.join(local[0], file), mode, *args, **kwargs)
+    return open(file, mode, *args,
+                opener=lambda p, flags: os.open(p, flags,
+                                                dir_fd=local[1].fd),
+                **kwargs)
+
+
+def local_stat(path, follow_symlinks=True):
+    """Like os.stat, but relative to the local directory"""
+    local = _local_dir.get()
+    path = os.path.expanduser(path)
+    if local is None or local[1] is None or os.path.isabs(path):
+        return os.stat(local_path(path), follow_symlinks=follow_symlinks)
+    return os.stat(path, dir_fd=local[1].fd,
+                   follow_symlinks=follow_symlinks)
+
+
+def local_listdir(path='.'):
+    """Like os.listdir, but relative to the local directory"""
+    local = _local_dir.get()
+    if local is not None and local[1] is not None and path in ('.', ''):
+        return os.listdir(local[1].fd)
+    return os.listdir(local_path(path))
+
+
+def local_run(cl, **kwargs):
+    """
+    Run `cl` with :func:`thtools.job_tools.run` in the local directory
+
+    :param list cl: Command line argument as a list of strings
+    :param kwargs: Further keyword arguments for subprocess.run
+    :return: The CompletedProcess instance
+    :rtype: subprocess.CompletedProcess
+    """
+    from .job_tools import run
+    return run(cl, cwd=local_getcwd(), **kwargs)
+
+
 def resolve_path(f, *dirs):
     """
     Try to find `f` here or in `dirs`; return absolute path to `f` if found
@@ -60,3 +195,132 @@ def resolve_path(f, *dirs):
         if os.path.isfile(path):
             return os.path.abspath(path)
     return f
+
+
+class PathResolver(object):
+    """
+    Resolve many files against the same search directories, like
+    :func:`resolve_path`, without checking each candidate path on disk
+
+    The names of the files in each search directory are listed once and
+    kept. A directory is listed again when its mtime changes (files were
+    added, removed or renamed in it). Its mtime is checked on each call of
+    :meth:`resolve` and once per call of :meth:`resolve_many`, so the
+    results are the same as those of :func:`resolve_path`. With `max_age`,
+    :meth:`resolve` skips that check for listings younger than `max_age`
+    seconds.
+
+    A single :meth:`resolve` still costs one stat for each directory
+    searched up to the one holding the file, as :func:`resolve_path` does.
+    The round trips are saved by :meth:`resolve_many`, which checks each
+    directory once for all the files, or by a `max_age`. Directories that
+    are the same (such as the current directory given again) are searched
+    only once.
+
+    Names containing a directory part (e.g. 'top/file.itp' or absolute
+    paths) are checked directly on disk as by :func:`resolve_path`.
+
+    :param dirs: Directories in which to search, in order, after the
+        current directory
+    :param float max_age: Default: 0. Seconds for which :meth:`resolve`
+        trusts a directory listing without checking the directory's mtime.
+        Files added or removed within that time may then be missed (or
+        returned after they were deleted).
+    """
+
+    def __init__(self, *dirs, max_age=0.):
+        self.dirs = ['', './'] + list(dirs)
+        self.max_age = max_age
+        self._listings = {}  # absolute dir: (mtime_ns, check time, names)
+
+    def resolve(self, f):
+        """
+        Return the absolute path to `f` if found, otherwise `f` as-is
+
+        :param str f: The file to be searched for
+        :return: The absolute path to `f`.
+        :rtype: str
+        """
+        valid_after = time.time() - self.max_age
+        return self._resolve(f, self._search_dirs(),
+                             lambda abs_d: self._names(abs_d, valid_after))
+
+    def resolve_many(self, files):
+        """
+        Resolve several files, checking each directory's mtime only once
+
+        :param list(str) files: The files to be searched for
+        :return: The resolved paths, in the same order as `files`
+        :rtype: list(str)
+        """
+        search_dirs = self._search_dirs()
+        now = time.time()
+        names = {abs_d: self._names(abs_d, now) for _, abs_d in search_dirs}
+        return [self._resolve(f, search_dirs, names.__getitem__)
+                for f in files]
+
+    def invalidate(self):
+        """Forget all directory listings"""
+        self._listings.clear()
+
+    def _search_dirs(self):
+        """
+        Each search directory and its absolute path, in order, leaving out
+        any that are the same as an earlier one
+        """
+        search_dirs = []
+        seen = set()
+        for d in self.dirs:
+            abs_d = os.path.abspath(d)
+            if abs_d not in seen:
+                seen.add(abs_d)
+                search_dirs.append((d, abs_d))
+        return search_dirs
+
+    def _resolve(self, f, search_dirs, names_of):
+        """
+        :param names_of: Function giving the names of the files in an
+            absolute directory; only called until `f` is found
+        """
+        if os.path.dirname(f):
+            for d, _ in search_dirs:
+                path = os.path.join(d, f)
+                if os.path.isfile(path):
+                    return os.path.abspath(path)
+            return f
+        for _, abs_d in search_dirs:
+            if f in names_of(abs_d):
+                return os.path.join(abs_d, f)
+        return f
+
+    def _names(self, abs_d, valid_after):
+        """The names of the files in `abs_d`, listing it again if needed"""
+        listing = self._listings.get(abs_d)
+        if listing is not None and listing[1] >= valid_after:
+            return listing[2]
+        now = time.time()
+        try:
+            mtime = os.stat(abs_d).st_mtime_ns
+        except OSError:
+            mtime = None
+        if listing is not None and listing[0] == mtime:
+            names = listing[2]
+        elif mtime is None:
+            names = frozenset()
+        else:
+            names = frozenset(_list_files(abs_d))
+            if now - mtime / 1e9 < 1.:
+                # the directory could change again within the resolution
+                # of its mtime, so do not trust this listing next time
+                mtime = -1
+        self._listings[abs_d] = (mtime, now, names)
+        return names
+
+
+def _list_files(d):
+    """Names of the files (following symlinks) in directory `d`"""
+    try:
+        with os.scandir(d) as it:
+            return [entry.name for entry in it if entry.is_file()]
+    except OSError:
+        return []
@@ -0,0 +1,305 @@
+"""
+Opt-in counters and timers that the rest of thtools reports into
+
+"""
+########################################################################
+#                                                                      #
+# This script was written by Thomas Heavey in 2018.                    #
+#        theavey@bu.edu     thomasjheavey@gmail.com                    #
+#                                                                      #
+# Copyright 2018 Thomas J. Heavey IV                                   #
+#                                                                      #
+# Licensed under the Apache License, Version 2.0 (the "License");      #
+# you may not use this file except in compliance with the License.     #
+# You may obtain a copy of the License at                              #
+#                                                                      #
+#    http://www.apache.org/licenses/LICENSE-2.0                        #
+#                                                                      #
+# Unless required by applicable law or agreed to in writing, software  #
+# distributed under the License is distributed on an "AS IS" BASIS,    #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or      #
+# implied.                                                             #
+# See the License for the specific language governing permissions and  #
+# limitations under the License.                                       #
+#                                                                      #
+########################################################################
+
+import functools
+import os
+import sys
+import threading
+import time
+
+# Recording is off unless this is set (to anything but '' or '0') or
+# enable() is called. When off, every hook returns after checking one flag.
+_enabled = os.environ.get('THTOOLS_INSTRUMENT', '') not in ('', '0')
+
+_lock = threading.Lock()
+_counters = {}  # name: total
+_timers = {}  # name: [calls, total, min, max] in seconds
+
+
+def enable():
+    """Start recording counters and timers"""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Stop recording (what was recorded so far is kept)"""
+    global _enabled
+    _enabled = False
+
+
+def enabled():
+    """Return whether counters and timers are being recorded"""
+    return _enabled
+
+
+def reset():
+    """Forget everything recorded so far"""
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+
+
+def count(name, n=1):
+    """
+    Add `n` to the counter `name`, if recording
+
+    :param str name: Name of the counter, e.g. 'saving.bytes_written'
+    :param n: Default: 1. Amount to add
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def add_time(name, seconds):
+    """
+    Record one call of `seconds` to the timer `name`, if recording
+
+    This is for durations measured some other way; usually :func:`timer`
+    is simpler.
+
+    :param str name: Name of the timer
+    :param float seconds: Wall time of the call
+    """
+    if not _enabled:
+        return
+    with _lock:
+        stats = _timers.get(name)
+        if stats is None:
+            _timers[name] = [1, seconds, seconds, seconds]
+            return
+        stats[0] += 1
+        stats[1] += seconds
+        if seconds < stats[2]:
+            stats[2] = seconds
+        if seconds > stats[3]:
+            stats[3] = seconds
+
+
+class _Timer(object):
+    """Context manager that records its wall time to a timer on exit"""
+
+    __slots__ = ('name', 'start', 'elapsed')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+        self.elapsed = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
+        add_time(self.name, self.elapsed)
+        return False
+
+
+class _NullTimer(object):
+    """Shared stand-in for :class:`_Timer` while not recording"""
+
+    __slots__ = ()
+    elapsed = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+def timer(name):
+    """
+    Context manager timing its block to the timer `name`, if recording
+
+    While not recording, this returns a shared do-nothing context manager,
+    so it is cheap to leave in place. When recording, the returned object's
+    `elapsed` attribute is the duration in seconds after the block.
+
+    :param str name: Name of the timer, e.g. 'job_tools.run'
+    """
+    if not _enabled:
+        return _null_timer
+    return _Timer(name)
+
+
+def timed(name=None):
+    """
+    Decorator timing each call of a function, if recording
+
+    :param str name: Default: None. Name of the timer; None to use the
+        function's module and qualified name.
+    """
+    def decorator(func):
+        timer_name = name or '{}.{}'.format(func.__module__,
+                                            func.__qualname__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Timer(timer_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TimedFile(object):
+    """
+    Wrapper of a binary file that times and counts its reads and writes
+
+    The time spent in read, readinto, readline, peek and write is recorded
+    to the timer `name` and the number of bytes moved to the counter
+    `name`.bytes. Everything else is passed through to the file.
+
+    Only meant to be used while recording: it costs a little for each call.
+
+    :param f: The file to wrap
+    :param str name: Name of the timer and prefix of the counter
+    """
+
+    def __init__(self, f, name):
+        self._f = f
+        self._name = name
+        self._bytes_name = name + '.bytes'
+
+    def _call(self, method, *args):
+        start = time.perf_counter()
+        result = method(*args)
+        add_time(self._name, time.perf_counter() - start)
+        return result
+
+    def read(self, *args):
+        data = self._call(self._f.read, *args)
+        count(self._bytes_name, len(data))
+        return data
+
+    def readline(self, *args):
+        data = self._call(self._f.readline, *args)
+        count(self._bytes_name, len(data))
+        return data
+
+    def readinto(self, b):
+        n = self._call(self._f.readinto, b)
+        count(self._bytes_name, n or 0)
+        return n
+
+    def peek(self, *args):
+        return self._call(self._f.peek, *args)
+
+    def write(self, b):
+        n = self._call(self._f.write, b)
+        count(self._bytes_name, n)
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._f.close()
+        return False
+
+
+def snapshot():
+    """
+    Return a copy of everything recorded so far
+
+    :return: {'counters': {name: total}, 'timers': {name: {'calls',
+        'total', 'mean', 'min', 'max'}}}, with times in seconds
+    :rtype: dict
+    """
+    with _lock:
+        counters = dict(_counters)
+        timers = {name: list(stats) for name, stats in _timers.items()}
+    return {'counters': counters,
+            'timers': {name: {'calls': calls, 'total': total,
+                              'mean': total / calls, 'min': t_min,
+                              'max': t_max}
+                       for name, (calls, total, t_min, t_max) in
+                       timers.items()}}
+
+
+def report(file=None):
+    """
+    Print a summary table of the counters and timers
+
+    Timers are sorted by total time, largest first.
+
+    :param file: Default: None. File to print to; None for sys.stdout.
+    :return: The table
+    :rtype: str
+    """
+    data = snapshot()
+    lines = []
+    if data['timers']:
+        width = max(len(name) for name in data['timers'])
+        lines.append('{:<{w}}  {:>8}  {:>10}  {:>10}  {:>10}'.format(
+            'timer', 'calls', 'total (s)', 'mean (ms)', 'max (ms)',
+            w=width))
+        for name, stats in sorted(data['timers'].items(),
+                                  key=lambda item: -item[1]['total']):
+            lines.append(
+                '{:<{w}}  {:>8d}  {:>10.3f}  {:>10.3f}  {:>10.3f}'.format(
+                    name, stats['calls'], stats['total'],
+                    stats['mean'] * 1e3, stats['max'] * 1e3, w=width))
+    if data['counters']:
+        if lines:
+            lines.append('')
+        width = max(len(name) for name in data['counters'])
+        lines.append('{:<{w}}  {:>14}'.format('counter', 'total', w=width))
+        for name, total in sorted(data['counters'].items()):
+            lines.append('{:<{w}}  {:>14,}'.format(name, total, w=width))
+    table = '\n'.join(lines) if lines else 'Nothing recorded'
+    print(table, file=file if file is not None else sys.stdout)
+    return table
+
+
+def to_json(path=None, **kwargs):
+    """
+    Return everything recorded (see :func:`snapshot`) as JSON
+
+    :param str path: Default: None. If given, the JSON is also written to
+        this file.
+    :param kwargs: Further keyword arguments for json.dumps, such as
+        `indent`
+    :return: The JSON document
+    :rtype: str
+    """
+    import json
+    text = json.dumps(snapshot(), sort_keys=True, **kwargs)
+    if path is not None:
+        with open(path, 'w') as f:
+            f.write(text)
+    return text
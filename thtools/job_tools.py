@@ -25,10 +25,94 @@ Functions helpful for some job management and such
 ########################################################################
 
 
+from collections import namedtuple
+import contextlib
 import os
 import re
-import shlex
 import subprocess
+import threading
+import time
+
+from . import instrumentation
+
+
+# How long (in seconds) scheduler query results are reused by default
+QSTAT_TTL = 5.
+QCONF_TTL = 300.
+
+JobRecord = namedtuple('JobRecord', ['job_id', 'name', 'owner', 'state',
+                                     'queue', 'slots', 'tasks',
+                                     'start_time', 'submission_time'])
+JobEvent = namedtuple('JobEvent', ['kind', 'job_id', 'job', 'time'])
+HostRecord = namedtuple('HostRecord', ['name', 'num_proc', 'mem_total',
+                                       'load_values', 'complex_values'])
+
+# Bytes read at a time from the output of commands run by arun
+_READ_SIZE = 1 << 16
+
+_cache = {}  # key: (time, result)
+# One lock per cache key, held while that key is queried, so a slow qstat
+# does not hold up get_hosts (or the other way around). _cache_lock only
+# guards creating these.
+_key_locks = {}
+_cache_lock = threading.Lock()
+
+_CGROUP_ROOT = '/sys/fs/cgroup'
+_resources = None
+
+
+class NodeResources(namedtuple('NodeResources', [
+        'hostname', 'mem_total', 'mem_available', 'mem_limit', 'n_cpus',
+        'cpus', 'cpu_quota', 'n_slots', 'source'])):
+    """
+    Memory and CPU resources of the current node, from
+    :func:`probe_node_resources`
+
+    Memory values are in MB (None if unknown or unlimited). `n_cpus` is
+    the total number of CPUs on the node, `cpus` the set this process may
+    run on, `cpu_quota` the cgroup CPU quota in CPUs (None if unlimited),
+    and `n_slots` the number of slots given to the job (from NSLOTS; None
+    outside of a job). `source` is 'local', 'qconf', or 'fallback' when
+    only the CPU count is known.
+    """
+
+    @property
+    def usable_cpus(self):
+        """Number of CPUs this job should use, e.g. to size a pool"""
+        limits = [len(self.cpus) or self.n_cpus]
+        if self.cpu_quota is not None:
+            limits.append(max(1, int(self.cpu_quota)))
+        if self.n_slots is not None:
+            limits.append(self.n_slots)
+        return min(limits)
+
+    @property
+    def usable_mem(self):
+        """
+        Memory (in MB) this job should use
+
+        This is the cgroup memory limit if there is one, otherwise the
+        node's memory scaled by the fraction of its CPUs this job uses.
+        None if the node's memory is not known.
+        """
+        if self.mem_total is None:
+            return None
+        if self.mem_limit is not None:
+            return min(self.mem_limit, self.mem_total)
+        return self.mem_total * self.usable_cpus / float(self.n_cpus)
+
+    def workers(self, mem_per_worker=None):
+        """
+        Number of workers for a pool, limited by CPUs and optionally memory
+
+        :param float mem_per_worker: Default: None. Memory (in MB) each
+            worker needs. Ignored if the node's memory is not known.
+        :rtype: int
+        """
+        n = self.usable_cpus
+        if mem_per_worker and self.mem_total is not None:
+            n = min(n, int(self.usable_mem // mem_per_worker))
+        return max(1, n)
 
 
 def get_node_mem(node=None):
@@ -40,46 +124,598 @@ def get_node_mem(node=None):
     For example, if the submitted job is only using 8 of a total of 16 cores
     on the node, this will return 90% of half of the node's total memory.
 
+    For the current node (`node` is None or its hostname), this comes from
+    :func:`probe_node_resources` without asking the scheduler, and respects
+    any cgroup memory limit on the job (see
+    :attr:`NodeResources.usable_mem`).
+
     :param str node: name of the node, such as 'scc-na1.scc.bu.edu'. If this
         is not given or set to None, it will be taken from the environment
         variable HOSTNAME.
     :return: 90% of the memory available, likely in GB
     :rtype: int
     """
+    if node is None or node == os.environ.get('HOSTNAME'):
+        resources = probe_node_resources()
+        if resources.usable_mem is None:
+            raise ValueError('Could not find the memory of this node')
+        return int(resources.usable_mem * 0.90 / 1000.)
     n_slots = float(os.environ['NSLOTS'])
-    if node is None:
-        node = os.environ['HOSTNAME']
-    cl = shlex.split('qconf -se {}'.format(node))
-    proc = run(cl)
-    m_proc = re.search(r'num_proc=(\d+)', proc.stdout)
-    if m_proc is None:
+    host = get_hosts([node]).get(node)
+    if host is None or host.num_proc is None:
         raise ValueError('Could not find n_proc for {}'.format(node))
-    p_of_c = n_slots / float(m_proc.group(1))
-    m = re.search(r'mem_total=(\d+\.\d+)M', proc.stdout)
-    return int(float(m.group(1)) * 0.90 * p_of_c / 1000.)
+    if host.mem_total is None:
+        raise ValueError('Could not find mem_total for {}'.format(node))
+    p_of_c = n_slots / float(host.num_proc)
+    return int(host.mem_total * 0.90 * p_of_c / 1000.)
 
 
-def running_jobs_names(user=None):
+def probe_node_resources(refresh=False):
+    """
+    Find the memory and CPUs available on the current node
+
+    On Linux, this reads /proc/meminfo, the cgroup (v1 or v2) memory and
+    CPU limits, and the CPU affinity of this process, without running any
+    commands. Elsewhere, it falls back to asking the scheduler with
+    :func:`get_hosts` for the node given by the HOSTNAME environment
+    variable, if `qconf` is on the PATH. If that is not possible either
+    (e.g., on a laptop), only the CPU count from os.cpu_count is known and
+    the memory values are None.
+
+    The result is cached for the life of the process.
+
+    :param bool refresh: Default: False. Probe again instead of using the
+        cached result.
+    :rtype: NodeResources
+    """
+    global _resources
+    if _resources is None or refresh:
+        n_slots = os.environ.get('NSLOTS')
+        n_slots = None if n_slots is None else int(n_slots)
+        try:
+            _resources = _probe_local(n_slots)
+        except OSError:
+            _resources = (_probe_qconf(n_slots) or
+                          _probe_fallback(n_slots))
+    return _resources
+
+
+def running_jobs_names(user=None, max_age=None):
     """
     Return the list of job names for a certain user
 
     :param str user: The user to list the jobs for. If user is None,
         the current user will be taken from the environment variable USER.
+    :param float max_age: Default: None. Reuse a job list up to this many
+        seconds old (see :func:`get_jobs`).
     :return: A list of the names of the currently running jobs
     :rtype: list
     """
+    return [job.name for job in get_jobs(user, max_age)]
+
+
+def get_jobs(user=None, max_age=None):
+    """
+    Return the jobs for a user from a single `qstat -xml` call
+
+    The result is cached and shared by all callers in this process (and
+    thread-safe), so polling loops only query the scheduler once every
+    `max_age` seconds however often they ask.
+
+    :param str user: The user to list the jobs for. If user is None,
+        the current user will be taken from the environment variable USER.
+    :param float max_age: Default: None. Reuse a job list up to this many
+        seconds old. If None, :data:`QSTAT_TTL` is used; 0 always queries.
+    :return: The running and pending jobs
+    :rtype: list(JobRecord)
+    """
     if user is None:
         user = os.environ['USER']
-    j_ns = []
-    proc = run(['qstat', '-r', '-u', user])
-    for line in proc.stdout.splitlines():
-        if 'Full jobname' in line:
-            m = re.search(r'Full jobname:\s+(\S+)', line)
-            j_ns.append(m.group(1))
-    return j_ns
+    max_age = QSTAT_TTL if max_age is None else max_age
+    key = ('qstat', user)
+    with _key_locks_for([key])[0]:
+        cached = _cache.get(key)
+        if (cached is None or max_age <= 0 or
+                time.time() - cached[0] > max_age):
+            jobs = list(_parse_qstat_xml(['qstat', '-xml', '-u', user]))
+            cached = _cache[key] = (time.time(), jobs)
+        else:
+            instrumentation.count('job_tools.qstat.cache_hits')
+    return list(cached[1])
+
+
+def get_hosts(nodes, max_age=None):
+    """
+    Return the configuration of several execution hosts
+
+    Hosts that are not already cached are queried with one
+    `qconf -se host1,host2,...` call.
+
+    :param list(str) nodes: Names of the nodes, such as 'scc-na1' or
+        'scc-na1.scc.bu.edu'
+    :param float max_age: Default: None. Reuse host information up to this
+        many seconds old. If None, :data:`QCONF_TTL` is used; 0 always
+        queries.
+    :return: Dict from the names in `nodes` to their records. Nodes unknown
+        to the scheduler are left out.
+    :rtype: dict
+    """
+    max_age = QCONF_TTL if max_age is None else max_age
+    hosts = {}
+    missing = _cached_hosts(nodes, max_age, hosts)
+    if not missing:
+        return hosts
+    with contextlib.ExitStack() as stack:
+        for lock in _key_locks_for([('qconf', node) for node in missing]):
+            stack.enter_context(lock)
+        # another thread may have queried some of them in the meantime
+        missing = _cached_hosts(missing, max_age, hosts)
+        if missing:
+            proc = run(['qconf', '-se', ','.join(missing)])
+            records = list(_parse_qconf_hosts(proc.stdout))
+            now = time.time()
+            for node in missing:
+                for host in records:
+                    if host.name == node or host.name.startswith(node + '.'):
+                        hosts[node] = host
+                        _cache[('qconf', node)] = (now, host)
+                        break
+    return hosts
+
+
+def _cached_hosts(nodes, max_age, hosts):
+    """
+    Put the cached records of `nodes` into `hosts`
+
+    :return: The nodes (without duplicates) not cached, or too old
+    :rtype: list(str)
+    """
+    now = time.time()
+    missing = []
+    for node in nodes:
+        if node in hosts or node in missing:
+            continue
+        cached = _cache.get(('qconf', node))
+        if cached is None or max_age <= 0 or now - cached[0] > max_age:
+            missing.append(node)
+        else:
+            hosts[node] = cached[1]
+            instrumentation.count('job_tools.qconf.cache_hits')
+    return missing
+
+
+def _key_locks_for(keys):
+    """The locks of cache `keys`, sorted so they can be taken in order"""
+    with _cache_lock:
+        return [_key_locks.setdefault(key, threading.Lock())
+                for key in sorted(set(keys))]
+
+
+def clear_scheduler_cache():
+    """Forget all cached `qstat` and `qconf` results"""
+    with _cache_lock:
+        _cache.clear()
+
+
+class JobWatcher(object):
+    """
+    Keep track of a user's jobs and report when they start, finish or fail
+
+    Each :meth:`poll` makes one (cached, see :func:`get_jobs`) `qstat`
+    query and compares it with the table of jobs from the last poll:
+
+    - 'started': a job (or any task of an array job) is running for the
+      first time
+    - 'failed': a job went into an error state (e.g., Eqw)
+    - 'finished': a job is no longer listed. Whether it succeeded is not
+      known without asking qacct.
+
+    Events are passed to callbacks added with :meth:`on`, or can be
+    consumed with `async for event in watcher.events()`. The poll interval
+    starts at `min_interval` and grows by `backoff` each time nothing
+    changes, up to `max_interval`.
+
+    Jobs already listed at the first poll do not produce 'started' events.
+
+    :param str user: Default: None. The user whose jobs to watch. If None,
+        the environment variable USER is used.
+    :param float min_interval: Default: 5. Shortest time between polls, in
+        seconds.
+    :param float max_interval: Default: 60. Longest time between polls.
+    :param float backoff: Default: 1.5. Factor by which the interval grows
+        while nothing changes.
+    """
+
+    kinds = ('started', 'finished', 'failed')
+
+    def __init__(self, user=None, min_interval=5., max_interval=60.,
+                 backoff=1.5):
+        self.user = os.environ['USER'] if user is None else user
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.jobs = None  # job_id: JobRecord; None before the first poll
+        self._callbacks = {kind: [] for kind in self.kinds}
+        self._lock = threading.Lock()
+
+    def on(self, kind, callback):
+        """
+        Call `callback(event)` for each event of this kind
+
+        :param str kind: 'started', 'finished' or 'failed'
+        :param callback: Function taking a JobEvent
+        """
+        if kind not in self._callbacks:
+            raise ValueError('Unknown event kind: {}'.format(kind))
+        self._callbacks[kind].append(callback)
+
+    def poll(self, max_age=None):
+        """
+        Update the job table once and dispatch any events
+
+        :param float max_age: Default: None. Reuse a cached job list up to
+            this many seconds old (see :func:`get_jobs`). If None, half of
+            `min_interval` is used.
+        :return: The events since the last poll
+        :rtype: list(JobEvent)
+        """
+        if max_age is None:
+            max_age = self.min_interval / 2.
+        records = get_jobs(self.user, max_age=max_age)
+        now = time.time()
+        with self._lock:
+            current = {}
+            for job in records:
+                # keep a running (or failed) task of an array job over the
+                # pending ones
+                old = current.get(job.job_id)
+                if old is None or _job_state(job) > _job_state(old):
+                    current[job.job_id] = job
+            events = []
+            previous = self.jobs
+            if previous is not None:
+                for job_id, job in current.items():
+                    old = previous.get(job_id)
+                    state = _job_state(job)
+                    old_state = 0 if old is None else _job_state(old)
+                    if state == 1 and old_state == 0:
+                        events.append(JobEvent('started', job_id, job, now))
+                    elif state == 2 and old_state != 2:
+                        events.append(JobEvent('failed', job_id, job, now))
+                for job_id, job in previous.items():
+                    if job_id not in current:
+                        events.append(JobEvent('finished', job_id, job,
+                                               now))
+            self.jobs = current
+            if events:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.max_interval,
+                                    self.interval * self.backoff)
+        for event in events:
+            for callback in self._callbacks[event.kind]:
+                callback(event)
+        return events
+
+    def wait_for(self, job_ids, timeout=None):
+        """
+        Block until all of `job_ids` have been listed and are gone again
+
+        Polls at the watcher's adaptive interval, sleeping in between. The
+        first poll always queries the scheduler, so a cached job list from
+        before the jobs were submitted is never used. A job that has not
+        been listed yet is still waited for (it may not be visible to
+        `qstat` right after submission).
+
+        :param job_ids: Job numbers (str or int) to wait for
+        :param float timeout: Default: None. Give up after this many
+            seconds and raise TimeoutError.
+        :return: None
+        """
+        waiting = {str(job_id) for job_id in job_ids}
+        seen = set()
+        deadline = None if timeout is None else time.time() + timeout
+        self.interval = self.min_interval
+        max_age = 0
+        while True:
+            self.poll(max_age)
+            max_age = None
+            seen.update(waiting.intersection(self.jobs))
+            waiting = {job_id for job_id in waiting
+                       if job_id in self.jobs or job_id not in seen}
+            if not waiting:
+                return
+            wait = self.interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    raise TimeoutError('Jobs not finished: {}'.format(
+                        sorted(waiting)))
+            time.sleep(wait)
+
+    async def events(self):
+        """
+        Asynchronously iterate over events, polling in a worker thread
+
+        The iteration never ends on its own; break out of it when done. As
+        with :meth:`wait_for`, the first poll always queries the scheduler.
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        max_age = 0
+        while True:
+            events = await loop.run_in_executor(None, self.poll, max_age)
+            max_age = None
+            for event in events:
+                yield event
+            await asyncio.sleep(self.interval)
+
+
+def _job_state(job):
+    """0 for pending (or unknown), 1 for running, 2 for an error state"""
+    state = job.state or ''
+    if 'E' in state:
+        return 2
+    if 'r' in state or 't' in state:
+        return 1
+    return 0
+
+
+def _parse_qstat_xml(cl):
+    """
+    Run `cl` and yield a JobRecord for each job_list in its XML output
+
+    The output is parsed as it is read, so the whole document is never held
+    in memory. stderr goes to a temporary file, so a command that writes a
+    lot to it cannot block on a full pipe.
+
+    :raises subprocess.CalledProcessError: if the command fails, with its
+        stderr (even if its output could not be parsed)
+    """
+    import tempfile
+    import xml.etree.ElementTree as ElementTree
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cl, stdout=subprocess.PIPE, stderr=stderr)
+        parse_error = None
+        with _command_timer('job_tools.popen', cl), proc:
+            try:
+                yield from _iter_job_records(ElementTree.iterparse(
+                    proc.stdout))
+            except ElementTree.ParseError as e:
+                parse_error = e  # e.g. no output; the exit status tells why
+        if proc.returncode:
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(
+                proc.returncode, cl,
+                stderr=stderr.read().decode(errors='replace'))
+        if parse_error is not None:
+            raise parse_error
+
+
+def _iter_job_records(events):
+    """Yield a JobRecord for each job_list element from iterparse"""
+    for _, elem in events:
+        if _local_tag(elem) != 'job_list':
+            continue
+        fields = {_local_tag(child): child.text for child in elem}
+        slots = fields.get('slots')
+        yield JobRecord(
+            job_id=fields.get('JB_job_number'),
+            name=fields.get('JB_name'),
+            owner=fields.get('JB_owner'),
+            state=fields.get('state'),
+            queue=fields.get('queue_name'),
+            slots=None if slots is None else int(slots),
+            tasks=fields.get('tasks'),
+            start_time=fields.get('JAT_start_time'),
+            submission_time=fields.get('JB_submission_time'))
+        elem.clear()
+
+
+def _local_tag(elem):
+    """Tag of `elem` without any namespace"""
+    return elem.tag.rpartition('}')[2]
+
+
+def _parse_qconf_hosts(text):
+    """Yield a HostRecord for each host in the output of `qconf -se`"""
+    fields = {}
+    # values may be continued over several lines ending in backslashes
+    for line in text.replace('\\\n', '').splitlines():
+        key, _, value = line.strip().partition(' ')
+        if not key:
+            continue
+        if key == 'hostname' and fields:
+            yield _host_record(fields)
+            fields = {}
+        fields[key] = value.strip()
+    if 'hostname' in fields:
+        yield _host_record(fields)
+
+
+def _host_record(fields):
+    load_values = _parse_values(fields.get('load_values', ''))
+    num_proc = load_values.get('num_proc')
+    mem_total = load_values.get('mem_total')
+    m = re.match(r'(\d+(?:\.\d+)?)M', mem_total or '')
+    return HostRecord(
+        name=fields['hostname'],
+        num_proc=None if num_proc is None else int(float(num_proc)),
+        mem_total=None if m is None else float(m.group(1)),
+        load_values=load_values,
+        complex_values=_parse_values(fields.get('complex_values', '')))
+
+
+def _probe_local(n_slots):
+    meminfo = {}
+    with open('/proc/meminfo') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            meminfo[key] = float(value.split()[0]) / 1024.  # kB to MB
+    n_cpus = os.cpu_count() or 1
+    try:
+        cpus = frozenset(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = frozenset(range(n_cpus))
+    mem_limit, cpu_quota, cpuset = _cgroup_limits()
+    if cpuset:
+        cpus = cpus & cpuset or cpus
+    mem_total = meminfo['MemTotal']
+    if mem_limit is not None and mem_limit >= mem_total:
+        mem_limit = None  # effectively unlimited
+    return NodeResources(hostname=os.uname()[1], mem_total=mem_total,
+                         mem_available=meminfo.get('MemAvailable'),
+                         mem_limit=mem_limit, n_cpus=n_cpus, cpus=cpus,
+                         cpu_quota=cpu_quota, n_slots=n_slots,
+                         source='local')
+
+
+def _probe_qconf(n_slots):
+    """The resources from `qconf`, or None if it cannot tell"""
+    import shutil
+    node = os.environ.get('HOSTNAME')
+    if node is None or shutil.which('qconf') is None:
+        return None
+    try:
+        host = get_hosts([node]).get(node)
+    except OSError:
+        return None
+    if host is None or host.num_proc is None or host.mem_total is None:
+        return None
+    return NodeResources(hostname=node, mem_total=host.mem_total,
+                         mem_available=None, mem_limit=None,
+                         n_cpus=host.num_proc,
+                         cpus=frozenset(range(host.num_proc)),
+                         cpu_quota=None, n_slots=n_slots, source='qconf')
+
+
+def _probe_fallback(n_slots):
+    import platform
+    n_cpus = os.cpu_count() or 1
+    try:
+        cpus = frozenset(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = frozenset(range(n_cpus))
+    return NodeResources(hostname=platform.node(), mem_total=None,
+                         mem_available=None, mem_limit=None, n_cpus=n_cpus,
+                         cpus=cpus, cpu_quota=None, n_slots=n_slots,
+                         source='fallback')
+
+
+def _cgroup_limits():
+    """
+    Find the cgroup limits on this process
+
+    :return: The memory limit in MB, the CPU quota in CPUs, and the set of
+        allowed CPUs; each None if there is none
+    """
+    try:
+        with open('/proc/self/cgroup') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None, None, None
+    groups = {}  # controller: path (v2 is under '')
+    for line in lines:
+        _, controllers, path = line.split(':', 2)
+        for controller in controllers.split(','):
+            groups[controller] = path
+    mem_limit = cpu_quota = cpuset = None
+    if groups.get('') is not None and os.path.exists(
+            os.path.join(_CGROUP_ROOT, 'cgroup.controllers')):
+        # cgroup v2: limits can be set at any level up the hierarchy
+        for d in _cgroup_dirs(_CGROUP_ROOT, groups['']):
+            value = _read_cgroup_file(d, 'memory.max')
+            if value not in (None, 'max'):
+                mem_limit = _min(mem_limit, int(value) / 1048576.)
+            value = _read_cgroup_file(d, 'cpu.max')
+            if value is not None and not value.startswith('max'):
+                quota, period = value.split()
+                cpu_quota = _min(cpu_quota, int(quota) / float(period))
+            if cpuset is None:
+                cpuset = _parse_cpu_list(_read_cgroup_file(
+                    d, 'cpuset.cpus.effective'))
+        return mem_limit, cpu_quota, cpuset
+    if 'memory' in groups:
+        for d in _cgroup_dirs(os.path.join(_CGROUP_ROOT, 'memory'),
+                              groups['memory'], walk=False):
+            value = _read_cgroup_file(d, 'memory.limit_in_bytes')
+            if value is not None:
+                mem_limit = int(value) / 1048576.
+                break
+    if 'cpu' in groups:
+        for d in _cgroup_dirs(os.path.join(_CGROUP_ROOT, 'cpu'),
+                              groups['cpu'], walk=False):
+            quota = _read_cgroup_file(d, 'cpu.cfs_quota_us')
+            period = _read_cgroup_file(d, 'cpu.cfs_period_us')
+            if quota is not None and period is not None:
+                if int(quota) > 0:
+                    cpu_quota = int(quota) / float(period)
+                break
+    if 'cpuset' in groups:
+        for d in _cgroup_dirs(os.path.join(_CGROUP_ROOT, 'cpuset'),
+                              groups['cpuset'], walk=False):
+            value = _read_cgroup_file(d, 'cpuset.effective_cpus')
+            if value is not None:
+                cpuset = _parse_cpu_list(value)
+                break
+    return mem_limit, cpu_quota, cpuset
+
+
+def _cgroup_dirs(mount, path, walk=True):
+    """
+    Candidate directories for the cgroup at `path` under `mount`
+
+    In a container the cgroup filesystem is often mounted at the process's
+    own cgroup, so the mount point itself is tried after the full path.
+    If `walk`, the parent cgroups are included too.
+    """
+    parts = [p for p in path.split('/') if p]
+    dirs = []
+    while True:
+        dirs.append(os.path.join(mount, *parts))
+        if not (walk and parts):
+            break
+        parts.pop()
+    if mount not in dirs:
+        dirs.append(mount)
+    return dirs
+
+
+def _read_cgroup_file(d, name):
+    try:
+        with open(os.path.join(d, name)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _parse_cpu_list(value):
+    """Parse a cpuset list such as '0-3,8' into a set of ints"""
+    if not value:
+        return None
+    cpus = set()
+    for part in value.split(','):
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return frozenset(cpus)
+
+
+def _min(a, b):
+    return b if a is None else min(a, b)
+
+
+def _parse_values(value):
+    """Parse a comma-separated list of name=value pairs into a dict"""
+    values = {}
+    for item in value.split(','):
+        name, sep, val = item.strip().partition('=')
+        if sep:
+            values[name] = val
+    return values
 
 
-def run(cl):
+def run(cl, **kwargs):
     """
     Use subprocess.run with the given command line and (my) standard options
 
@@ -90,10 +726,153 @@ def run(cl):
 
     :param list cl: Command line argument as a list of strings (e.g.,
     as returned by shlex.split).
+    :param kwargs: Further keyword arguments for subprocess.run, such as
+        `cwd`. These override the standard options.
     :return: The CompletedProcess instance
     :rtype: subprocess.CompletedProcess
     """
-    return subprocess.run(cl,
-                          universal_newlines=True,
-                          stdout=subprocess.PIPE,
-                          stderr=subprocess.STDOUT)
+    options = dict(universal_newlines=True,
+                   stdout=subprocess.PIPE,
+                   stderr=subprocess.STDOUT)
+    options.update(kwargs)
+    with _command_timer('job_tools.run', cl):
+        return subprocess.run(cl, **options)
+
+
+async def arun(cl, timeout=None, on_stdout=None, on_stderr=None):
+    """
+    Asyncio counterpart to :func:`run`
+
+    Unlike :func:`run`, stderr is kept separate from stdout. Both are read
+    line by line as the command runs, and each line can be passed to a
+    callback as it arrives.
+
+    :param list cl: Command line argument as a list of strings (e.g.,
+        as returned by shlex.split).
+    :param float timeout: Default: None. If the command takes longer than
+        this many seconds, it is killed and subprocess.TimeoutExpired is
+        raised.
+    :param on_stdout: Default: None. Function called with each line of
+        stdout (including its newline) as it is read.
+    :param on_stderr: Default: None. Function called with each line of
+        stderr as it is read.
+    :return: The CompletedProcess instance
+    :rtype: subprocess.CompletedProcess
+    """
+    import asyncio
+    with _command_timer('job_tools.arun', cl):
+        proc = await asyncio.create_subprocess_exec(
+            *cl, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = [], []
+        readers = asyncio.gather(
+            _read_lines(proc.stdout, stdout, on_stdout),
+            _read_lines(proc.stderr, stderr, on_stderr),
+            proc.wait())
+        try:
+            await asyncio.wait_for(readers, timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise subprocess.TimeoutExpired(cl, timeout,
+                                            output=''.join(stdout),
+                                            stderr=''.join(stderr))
+        except BaseException:  # e.g., cancelled; do not leave it running
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+    return subprocess.CompletedProcess(cl, proc.returncode,
+                                       stdout=''.join(stdout),
+                                       stderr=''.join(stderr))
+
+
+async def arun_many(commands, max_concurrency=8, timeout=None,
+                    return_exceptions=False):
+    """
+    Run several commands concurrently with :func:`arun`
+
+    :param list commands: The command lines to run, each a list of strings
+    :param int max_concurrency: Default: 8. Maximum number of commands
+        running at once.
+    :param float timeout: Default: None. Timeout in seconds for each
+        command (see :func:`arun`).
+    :param bool return_exceptions: Default: False. If True, an exception
+        raised for a command (such as subprocess.TimeoutExpired) is returned
+        in its place instead of being raised.
+    :return: The CompletedProcess instances, in the same order as `commands`
+    :rtype: list
+    """
+    import asyncio
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_one(cl):
+        async with semaphore:
+            return await arun(cl, timeout=timeout)
+
+    return await asyncio.gather(*(run_one(cl) for cl in commands),
+                                return_exceptions=return_exceptions)
+
+
+def run_many(commands, max_concurrency=8, timeout=None,
+             return_exceptions=False):
+    """
+    Run several commands concurrently and wait for all of them
+
+    This starts its own event loop, so it cannot be called from a coroutine;
+    use `await arun_many(...)` there instead.
+
+    See :func:`arun_many` for the parameters.
+
+    :return: The CompletedProcess instances, in the same order as `commands`
+    :rtype: list
+    """
+    import asyncio
+    return asyncio.run(arun_many(commands, max_concurrency, timeout,
+                                 return_exceptions))
+
+
+def _command_timer(kind, cl):
+    """
+    Timer (see :mod:`thtools.instrumentation`) for running `cl`, named
+    `kind`[program]
+    """
+    if not instrumentation.enabled():
+        return instrumentation.timer(kind)
+    program = cl.split()[0] if isinstance(cl, str) else os.fspath(cl[0])
+    return instrumentation.timer('{}[{}]'.format(
+        kind, os.path.basename(program)))
+
+
+async def _read_lines(stream, lines, callback=None):
+    """
+    Read `stream` to its end, appending each line to `lines`
+
+    The stream is read in chunks and split into lines here, because
+    iterating over it fails for lines longer than the StreamReader's limit
+    (64 KiB by default).
+    """
+    import codecs
+    import locale
+    decoder = codecs.getincrementaldecoder(
+        locale.getpreferredencoding(False))(errors='replace')
+    pending = []  # pieces of a line whose newline has not been read yet
+
+    def add_line(line):
+        lines.append(line)
+        if callback is not None:
+            callback(line)
+
+    while True:
+        chunk = await stream.read(_READ_SIZE)
+        parts = decoder.decode(chunk, final=not chunk).split('\n')
+        for part in parts[:-1]:
+            pending.append(part)
+            add_line(''.join(pending) + '\n')
+            pending = []
+        if parts[-1]:
+            pending.append(parts[-1])
+        if not chunk:
+            break
+    if pending:
+        add_line(''.join(pending))
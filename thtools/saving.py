@@ -25,27 +25,628 @@ Functions for saving fairly arbitrary python objects
 ########################################################################
 
 
+import array
+import atexit
+import collections
+import collections.abc
+import contextlib
+import functools
+import importlib
+import io
+import itertools
+import mmap as _mmap
 import os
 import pickle
+import queue
+import struct
+import threading
+import time
+import zlib
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # no advisory locking (e.g., on Windows)
 
+from . import instrumentation
 
-def save_obj(obj, name):
-    path = _make_path(name)
-    with open(path, 'wb') as f:
-        pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+
+# Buffers smaller than this (in bytes) are kept inside the pickle itself
+# when saving out of band; there is no point in a sidecar file for them.
+OOB_THRESHOLD = 1 << 16
+
+# Each record in a record log is framed by its length and crc32
+_RECORD_HEADER = struct.Struct('<QI')
+_INDEX_ENTRY = struct.Struct('<Q')
+
+# Compressed pickles start with this (no pickle can start with a null byte),
+# followed by the codec name; then come length-prefixed compressed chunks,
+# ending with a zero length.
+_CODEC_MAGIC = b'\x00THTZ\x01'
+_CHUNK_HEADER = struct.Struct('<Q')
+CHUNK_SIZE = 4 << 20
+
+# name: (compress(data, level), decompress(data)); see register_codec
+CODECS = {}
+# stdlib codecs, only imported when first used
+_STDLIB_CODECS = {'zlib': ('zlib', 'level'),
+                  'lzma': ('lzma', 'preset'),
+                  'bz2': ('bz2', 'compresslevel')}
+
+
+def save_obj(obj, name, out_of_band=False, codec=None, level=None,
+             threads=None, lock=False, sharded=False):
+    """
+    Pickle `obj` to obj/`name`.pkl
+
+    The pickle is written to a temporary file that is then renamed over
+    obj/`name`.pkl, so a killed job can never leave a truncated file behind
+    and readers see either the old or the new object.
+
+    :param obj: The object to be saved
+    :param str name: Name of the object. The file is saved as `name`.pkl in
+        the obj directory next to `name` (see :func:`make_obj_dir`).
+    :param bool out_of_band: Default: False. If True, large buffer-backed
+        payloads (NumPy arrays, array.array, or anything wrapped in
+        pickle.PickleBuffer) are written with pickle protocol 5 to sidecar
+        files (`name`.pkl.0, `name`.pkl.1, ...) instead of being copied
+        into the pickle stream. These can then be memory-mapped by
+        :func:`load_obj`. Sidecar files are never compressed. Plain bytes
+        (and bytearray) stay in the pickle stream unless wrapped in
+        pickle.PickleBuffer.
+    :param str codec: Default: None. Compress the pickle with this codec:
+        'zlib', 'lzma', 'bz2', or any added with :func:`register_codec`.
+        The codec is recorded in the file, so :func:`load_obj` does not need
+        to be told about it.
+    :param int level: Default: None. Compression level passed to the codec;
+        None for the codec's default.
+    :param int threads: Default: None. Number of threads used to compress
+        (and decompress) chunks of :data:`CHUNK_SIZE` bytes in parallel.
+        None to use up to 4 threads, depending on the CPU count.
+    :param bool lock: Default: False. Hold an exclusive advisory lock on
+        obj/`name`.pkl.lock while saving. Use this (with `lock` in
+        :func:`load_obj`) when several jobs write the same object with
+        out-of-band buffers, which are several files that cannot be
+        replaced in one atomic step.
+    :param bool sharded: Default: False. Save in the hash-sharded layout,
+        obj/`xx`/`name`.pkl, where `xx` is one of 256 subdirectories picked
+        by a hash of `name`. This keeps directories small with very many
+        objects. The shard directory is created if needed.
+    :return: The path to the saved pickle
+    :rtype: str
+    """
+    path = _make_path(name, sharded=sharded)
+    # the time not spent in 'saving.write' is pickling (and compressing)
+    with instrumentation.timer('saving.save_obj'):
+        try:
+            _dump(obj, path, out_of_band, codec, level, threads, lock)
+        except FileNotFoundError:
+            if not sharded or os.path.isdir(os.path.dirname(path)):
+                raise
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _dump(obj, path, out_of_band, codec, level, threads, lock)
     return path
 
 
-def load_obj(name):
+def load_obj(name, mmap=False, threads=None, lock=False, sharded=False):
+    """
+    Load a pickled object saved with :func:`save_obj`
+
+    :param str name: Name of the object, or the path to the .pkl file
+    :param bool mmap: Default: False. If True, out-of-band buffers are
+        memory-mapped read-only instead of being read into memory. Only
+        types that can be rebuilt on a foreign buffer, such as NumPy arrays
+        and objects that unpickle from a PickleBuffer without copying, are
+        then zero-copy: they are backed by the page cache (so they are
+        read-only and shared between processes) and only the parts that
+        are touched are ever read from disk. array.array payloads are
+        copied in full into a new array.
+    :param int threads: Default: None. Number of threads used to decompress
+        a compressed pickle. None to use up to 4 threads, depending on the
+        CPU count.
+    :param bool lock: Default: False. Hold a shared advisory lock on the
+        pickle's .lock file while loading (see :func:`save_obj`).
+    :param bool sharded: Default: False. Whether the object was saved in
+        the sharded layout (see :func:`save_obj`).
+    :return: The unpickled object
+    """
     if '.pkl' in name:
         path = name
     else:
-        path = _make_path(name)
+        path = _make_path(name, sharded=sharded)
+    # the time not spent in 'saving.read' is unpickling (and decompressing)
+    with instrumentation.timer('saving.load_obj'), \
+            _locked(path, lock, exclusive=False), \
+            _open_decompressed(path, threads) as f:
+        return pickle.load(f, buffers=_iter_buffers(path, mmap))
+
+
+def save_many(objs, workers=None, processes=False, **kwargs):
+    """
+    Save many objects concurrently with :func:`save_obj`
+
+    :param objs: Dict from names to objects, or an iterable of (name, obj)
+        pairs
+    :param int workers: Default: None. Number of workers. None to use a
+        few per CPU available to this job (see
+        :func:`thtools.job_tools.probe_node_resources`).
+    :param bool processes: Default: False. Use a process pool instead of
+        threads. Each object is then pickled once more to send it to its
+        worker, so this only pays off when compression dominates.
+    :param kwargs: Keyword arguments for :func:`save_obj`, such as
+        `sharded` or `codec`
+    :return: Dict from names to the paths they were saved to
+    :rtype: dict
+    """
+    items = objs.items() if isinstance(objs, collections.abc.Mapping) \
+        else objs
+    pool, _ = _batch_executor(workers, processes)
+    with pool:
+        futures = [(name, pool.submit(save_obj, obj, name, **kwargs))
+                   for name, obj in items]
+        return {name: future.result() for name, future in futures}
+
+
+def load_many(names, workers=None, processes=False, **kwargs):
+    """
+    Load many objects concurrently with :func:`load_obj`
+
+    See :func:`iter_load` for the parameters.
+
+    :return: Dict from names to the loaded objects
+    :rtype: dict
+    """
+    return dict(iter_load(names, workers, processes, **kwargs))
+
+
+def iter_load(names, workers=None, processes=False, **kwargs):
+    """
+    Load many objects concurrently, yielding each as soon as it is loaded
+
+    Only a few objects more than the number of workers are loaded ahead of
+    the consumer, so memory use stays bounded however many names are given.
+
+    :param names: Iterable of names (or paths) of the objects
+    :param int workers: Default: None. Number of workers. None to use a
+        few per CPU available to this job.
+    :param bool processes: Default: False. Use a process pool instead of
+        threads. Each object is then pickled again to send it back from its
+        worker, and `mmap` cannot be used.
+    :param kwargs: Keyword arguments for :func:`load_obj`, such as
+        `sharded`
+    :return: Generator of (name, obj) pairs, in the order they finish
+        loading
+    """
+    from concurrent.futures import FIRST_COMPLETED, wait
+    names = iter(names)
+    pool, workers = _batch_executor(workers, processes)
+    with pool:
+        max_pending = 2 * workers
+        pending = {}
+        while True:
+            for name in itertools.islice(names, max_pending - len(pending)):
+                pending[pool.submit(load_obj, name, **kwargs)] = name
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+
+
+def register_codec(name, compress, decompress):
+    """
+    Add a codec that can be used by :func:`save_obj`
+
+    :param str name: Name of the codec (at most 255 bytes when encoded).
+        This is written into each file saved with it.
+    :param compress: Function called as compress(data, level) that returns
+        the compressed bytes. `level` is None unless one is given to
+        :func:`save_obj`. It is called from several threads at once.
+    :param decompress: Function called as decompress(data) that returns the
+        decompressed bytes.
+    :return: None
+    """
+    if len(name.encode()) > 255:
+        raise ValueError('Codec name too long: {}'.format(name))
+    CODECS[name] = (compress, decompress)
+
+
+def disk_cache(func=None, directory='./', maxsize=128, max_bytes=None,
+               max_age=None):
+    """
+    Memoize a function in memory and on disk under the obj directory
+
+    Results are keyed by a hash of the function's qualified name, its source
+    and the (pickled) arguments, so editing the function invalidates its old
+    results. They are pickled to
+    `directory`/obj/cache/`module.qualname`/`key`.pkl, and the most recently
+    used `maxsize` results are also kept in memory.
+
+    Entries are saved atomically (as by :func:`save_obj`), so several jobs
+    can safely fill the same cache at once: readers only ever see complete
+    entries, and the worst case is two jobs computing the same result.
+
+    Can be used as either `@disk_cache` or `@disk_cache(max_age=3600)`.
+    The wrapped function gets `cache_clear()` and `cache_prune()`
+    attributes.
+
+    :param func: The function to wrap
+    :param str directory: Default: './'. Directory holding the obj directory
+    :param int maxsize: Default: 128. Number of results to keep in memory.
+        If 0 or None, nothing is kept in memory.
+    :param int max_bytes: Default: None. If given, the oldest entries on
+        disk are removed after each store until the function's cache is at
+        most this many bytes.
+    :param float max_age: Default: None. If given, entries older than this
+        many seconds are ignored and removed.
+    :return: The wrapped function
+    """
+    if func is None:
+        return functools.partial(disk_cache, directory=directory,
+                                 maxsize=maxsize, max_bytes=max_bytes,
+                                 max_age=max_age)
+    import hashlib
+    import inspect
+    cache_dir = os.path.join(directory, 'obj', 'cache',
+                             '{}.{}'.format(func.__module__,
+                                            func.__qualname__))
+    sig = inspect.signature(func)
+    func_hash = hashlib.sha256(func.__qualname__.encode())
+    try:
+        func_hash.update(inspect.getsource(func).encode())
+    except (OSError, TypeError):
+        func_hash.update(func.__code__.co_code)
+    memory = collections.OrderedDict()
+    lock = threading.Lock()
+
+    def make_key(args, kwargs):
+        bound = sig.bind(*args, **kwargs)
+        bound.apply_defaults()
+        h = func_hash.copy()
+        h.update(pickle.dumps((bound.args, sorted(bound.kwargs.items())),
+                              pickle.HIGHEST_PROTOCOL))
+        return h.hexdigest()
+
+    def prune():
+        if max_bytes is None and max_age is None:
+            return
+        entries = []
+        try:
+            with os.scandir(cache_dir) as it:
+                for entry in it:
+                    if not entry.name.endswith('.pkl'):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue  # removed by another job
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        except FileNotFoundError:
+            return
+        entries.sort()
+        total = sum(e[1] for e in entries)
+        cutoff = None if max_age is None else time.time() - max_age
+        for mtime, size, path in entries:
+            if ((cutoff is None or mtime >= cutoff) and
+                    (max_bytes is None or total <= max_bytes)):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear():
+        with lock:
+            memory.clear()
+        try:
+            with os.scandir(cache_dir) as it:
+                for entry in it:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+        except FileNotFoundError:
+            pass
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = make_key(args, kwargs)
+        with lock:
+            if key in memory:
+                memory.move_to_end(key)
+                return memory[key]
+        path = os.path.join(cache_dir, key + '.pkl')
+        try:
+            if max_age is not None and \
+                    os.stat(path).st_mtime < time.time() - max_age:
+                raise FileNotFoundError(path)
+            result = load_obj(path)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            result = func(*args, **kwargs)
+            os.makedirs(cache_dir, exist_ok=True)
+            _dump(result, path)
+            prune()
+        if maxsize:
+            with lock:
+                memory[key] = result
+                if len(memory) > maxsize:
+                    memory.popitem(last=False)
+        return result
+
+    wrapper.cache_clear = clear
+    wrapper.cache_prune = prune
+    return wrapper
+
+
+class AsyncSaver(object):
+    """
+    Save objects with :func:`save_obj` on a background thread
+
+    :meth:`save` only queues the object, so the calling loop can continue
+    computing while it is pickled and written. The object must therefore
+    not be modified after it is passed to :meth:`save`.
+
+    Any exception raised while saving is re-raised by the next call to
+    :meth:`save`, :meth:`flush` or :meth:`close`; objects that were queued
+    after the failed one up to that point are not saved.
+
+    Use as a context manager, or call :meth:`close` when done::
+
+        with AsyncSaver() as saver:
+            for i, frame in enumerate(frames):
+                saver.save(analyze(frame), 'frame{}'.format(i))
+
+    If the interpreter exits normally (including by sys.exit or an
+    uncaught exception) without :meth:`close`, it is called from an atexit
+    handler, so everything queued is still saved before the process ends.
+    A process that is killed, or that ends with os._exit, loses whatever
+    was still queued.
+
+    :param int maxsize: Default: 2. Maximum number of objects waiting to be
+        saved. :meth:`save` blocks when this many are queued, which bounds
+        the memory held by pending objects.
+    :param save_kwargs: Default keyword arguments for :func:`save_obj`
+    """
+
+    def __init__(self, maxsize=2, **save_kwargs):
+        self.save_kwargs = save_kwargs
+        self._queue = queue.Queue(maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._worker,
+                                        name='thtools-AsyncSaver',
+                                        daemon=True)
+        self._thread.start()
+        # a daemon thread is stopped abruptly at exit, so finish the queue
+        # first (a non-daemon one would keep the interpreter from exiting)
+        atexit.register(self.close)
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                obj, name, kwargs = item
+                if self._error is None:
+                    save_obj(obj, name, **kwargs)
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def save(self, obj, name, **kwargs):
+        """
+        Queue `obj` to be saved as `name`
+
+        :param obj: The object to be saved
+        :param str name: Name of the object, as for :func:`save_obj`
+        :param kwargs: Keyword arguments for :func:`save_obj`, overriding
+            those given to the AsyncSaver
+        :return: The path the object will be saved to
+        :rtype: str
+        """
+        self._raise_error()
+        if not self._thread.is_alive():
+            raise ValueError('AsyncSaver is closed')
+        _kwargs = dict(self.save_kwargs)
+        _kwargs.update(kwargs)
+        self._queue.put((obj, name, _kwargs))
+        return _make_path(name, sharded=_kwargs.get('sharded', False))
+
+    def flush(self):
+        """Wait until everything queued so far has been saved"""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Save everything queued and stop the background thread"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        atexit.unregister(self.close)
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RecordWriter(object):
+    """
+    Append pickled records one at a time to obj/`name`.rec
+
+    Each call to :meth:`append` costs only the size of the new record, so
+    this is suited to checkpointing a growing list of results. Records are
+    framed with their length and crc32; if a previous writer was killed
+    part way through a record, the partial record is truncated when the
+    file is reopened.
+
+    Use as a context manager, or call :meth:`close` when done.
+
+    :param str name: Name of the log, as for :func:`save_obj`
+    :param bool index: Default: False. Also write obj/`name`.rec.idx with
+        the offset of each record for random access by
+        :class:`RecordReader`. If False, an index left by an earlier writer
+        is removed, since it would no longer be kept up to date.
+    :param int flush_every: Default: 1. Flush to the OS after this many
+        records. None to only flush on :meth:`flush` and :meth:`close`.
+    :param float flush_interval: Default: None. Also flush when this many
+        seconds have passed since the last flush.
+    :param bool fsync: Default: False. Also fsync on each flush so records
+        survive a node crash, not just a killed process.
+    """
+
+    def __init__(self, name, index=False, flush_every=1, flush_interval=None,
+                 fsync=False):
+        self.path = _make_path(name, '.rec')
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        end, offsets = _scan_records(self.path)
+        self._f = open(self.path, 'ab')
+        self._f.truncate(end)  # drop a partial record from a killed writer
+        self._f.seek(end)
+        self._idx = None
+        if index:
+            self._idx = open(self.path + '.idx', 'ab')
+            self._idx.truncate(0)
+            self._idx.write(b''.join(_INDEX_ENTRY.pack(o) for o in offsets))
+        else:
+            try:
+                os.remove(self.path + '.idx')
+            except FileNotFoundError:
+                pass
+        self._pending = 0
+        self._last_flush = time.time()
+
+    def append(self, obj):
+        """Pickle `obj` and append it as a new record"""
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        if self._idx is not None:
+            self._idx.write(_INDEX_ENTRY.pack(self._f.tell()))
+        self._f.write(_RECORD_HEADER.pack(len(data), zlib.crc32(data)))
+        self._f.write(data)
+        self._pending += 1
+        if ((self.flush_every and self._pending >= self.flush_every) or
+                (self.flush_interval is not None and
+                 time.time() - self._last_flush >= self.flush_interval)):
+            self.flush()
+
+    def flush(self):
+        """Flush written records to the OS (and disk, if `fsync`)"""
+        for f in (self._f, self._idx):
+            if f is None:
+                continue
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self._pending = 0
+        self._last_flush = time.time()
+
+    def close(self):
+        if self._f.closed:
+            return
+        self.flush()
+        self._f.close()
+        if self._idx is not None:
+            self._idx.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def iter_records(name):
+    """
+    Lazily yield the records of a log written by :class:`RecordWriter`
+
+    Only one record is held in memory at a time. A truncated final record
+    (from a writer that was killed) is silently ignored.
+
+    :param str name: Name of the log, or the path to the .rec file
+    """
+    path = name if name.endswith('.rec') else _make_path(name, '.rec')
     with open(path, 'rb') as f:
-        return pickle.load(f)
+        while True:
+            record = _read_record(f)
+            if record is None:
+                return
+            yield record
+
+
+class RecordReader(object):
+    """
+    Random access to the records of a log written by :class:`RecordWriter`
 
+    Offsets are read from the .idx file if the log was written with
+    `index=True`, otherwise (or if the index does not cover the whole log)
+    they are found by skipping through the record headers once (without
+    reading the records themselves).
 
-def make_obj_dir(directory='./'):
+    :param str name: Name of the log, or the path to the .rec file
+    """
+
+    def __init__(self, name):
+        self.path = name if name.endswith('.rec') else _make_path(name,
+                                                                  '.rec')
+        self._f = open(self.path, 'rb')
+        self._offsets = None
+
+    @property
+    def offsets(self):
+        if self._offsets is None:
+            try:
+                with open(self.path + '.idx', 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                self._offsets = _scan_records(self.path)[1]
+            else:
+                data = data[:len(data) - len(data) % _INDEX_ENTRY.size]
+                offsets = [o for (o,) in _INDEX_ENTRY.iter_unpack(data)]
+                # the index may be ahead of a partially written record
+                end = 0
+                while offsets:
+                    self._f.seek(offsets[-1])
+                    if _read_record(self._f, load=False):
+                        end = self._f.tell()
+                        break
+                    offsets.pop()
+                if end != os.fstat(self._f.fileno()).st_size:
+                    # records after the index (or a partial one at the end)
+                    offsets = _scan_records(self.path)[1]
+                self._offsets = offsets
+        return self._offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        self._f.seek(self.offsets[i])
+        return _read_record(self._f)
+
+    def __iter__(self):
+        return iter_records(self.path)
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def make_obj_dir(directory='./', sharded=False):
     try:
         os.makedirs(directory+'obj')
     except OSError as e:
@@ -53,8 +654,380 @@ def make_obj_dir(directory='./'):
             pass  # catch and ignore FileExistsError (or the Py2 equivalent)
         else:
             raise
+    if sharded:
+        for i in range(256):
+            os.makedirs(os.path.join(directory+'obj', '{:02x}'.format(i)),
+                        exist_ok=True)
 
-def _make_path(name):
+def _make_path(name, ext='.pkl', sharded=False):
     d, b = os.path.split(name)
-    return os.path.join(d, 'obj/', b + '.pkl')
+    if sharded:
+        shard = '{:02x}'.format(zlib.crc32(b.encode()) & 0xff)
+        return os.path.join(d, 'obj/', shard, b + ext)
+    return os.path.join(d, 'obj/', b + ext)
+
+
+def _dump(obj, path, out_of_band=False, codec=None, level=None,
+          threads=None, lock=False):
+    buffers = []
+
+    def callback(buf):
+        if buf.raw().nbytes < OOB_THRESHOLD:
+            return True  # keep small buffers in-band
+        buffers.append(buf)
+        return False
+
+    timed = instrumentation.enabled()
+    with _locked(path, lock), _atomic_open(path) as raw:
+        if timed:
+            raw = instrumentation.TimedFile(raw, 'saving.write')
+        with _open_compressed(raw, codec, level, threads) as f:
+            if out_of_band:
+                _OOBPickler(f, 5, buffer_callback=callback).dump(obj)
+            else:
+                pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        # buffers go in place before the pickle that refers to them
+        for i, buf in enumerate(buffers):
+            with _atomic_open(_buffer_path(path, i)) as f:
+                if timed:
+                    f = instrumentation.TimedFile(f, 'saving.write')
+                f.write(buf.raw())
+        _remove_buffers(path, start=len(buffers))
+
+
+@contextlib.contextmanager
+def _atomic_open(path):
+    """
+    Open a temporary file next to `path` for writing, then rename it to
+    `path` if no exception was raised (or remove it if one was)
+    """
+    tmp = '{}.{}.{}.tmp'.format(path, os.getpid(), os.urandom(4).hex())
+    # unlike tempfile.mkstemp, this respects the umask for the permissions
+    f = os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666),
+                  'wb')
+    try:
+        with f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+@contextlib.contextmanager
+def _locked(path, lock=True, exclusive=True):
+    """Hold an advisory lock on `path`.lock, if `lock` and it is supported"""
+    if not lock or fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a+b') as f:
+        # lockf (unlike flock) also works across nodes on NFS
+        fcntl.lockf(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.lockf(f, fcntl.LOCK_UN)
+
+
+def _buffer_path(path, i):
+    return '{}.{}'.format(path, i)
+
+
+def _iter_buffers(path, mmap=False):
+    """Lazily yield the out-of-band buffers saved next to `path`, in order"""
+    for i in itertools.count():
+        try:
+            f = open(_buffer_path(path, i), 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            if not mmap:
+                buf = bytearray(os.fstat(f.fileno()).st_size)
+                if instrumentation.enabled():
+                    instrumentation.TimedFile(f, 'saving.read').readinto(buf)
+                else:
+                    f.readinto(buf)
+                yield buf
+            elif os.fstat(f.fileno()).st_size == 0:
+                yield b''  # empty files cannot be mapped
+            else:
+                # the map stays valid after the file is closed, and is
+                # unmapped once the last array using it is released
+                yield _mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ)
+
+
+def _remove_buffers(path, start=0):
+    """Remove stale sidecar buffers left over from an earlier save"""
+    for i in itertools.count(start):
+        try:
+            os.remove(_buffer_path(path, i))
+        except FileNotFoundError:
+            return
+
+
+def _read_record(f, load=True):
+    """
+    Read the record at the current position of `f`
+
+    :param f: The open log file
+    :param bool load: Default: True. If False, only check that the record
+        is complete and return True.
+    :return: The record, or None if at the end of the log or the record is
+        incomplete
+    """
+    header = f.read(_RECORD_HEADER.size)
+    if len(header) < _RECORD_HEADER.size:
+        return None
+    size, crc = _RECORD_HEADER.unpack(header)
+    data = f.read(size)
+    if len(data) < size or zlib.crc32(data) != crc:
+        return None
+    return pickle.loads(data) if load else True
+
+
+def _scan_records(path):
+    """
+    Find the offsets of the complete records in a log
+
+    This only reads the record headers (and the last record, to check that
+    it was completely written).
+
+    :return: The offset of the end of the last complete record, and the list
+        of offsets of the records
+    :rtype: tuple(int, list)
+    """
+    offsets = []
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return 0, offsets
+    with f:
+        file_size = os.fstat(f.fileno()).st_size
+        end = 0
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                break
+            size, crc = _RECORD_HEADER.unpack(header)
+            next_end = end + _RECORD_HEADER.size + size
+            if next_end > file_size:
+                break
+            if next_end == file_size and zlib.crc32(f.read(size)) != crc:
+                break
+            offsets.append(end)
+            end = next_end
+            f.seek(end)
+    return end, offsets
+
+
+def _get_codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        pass
+    try:
+        module_name, level_kw = _STDLIB_CODECS[name]
+    except KeyError:
+        raise ValueError('Unknown codec: {}'.format(name))
+    module = importlib.import_module(module_name)
+
+    def compress(data, level=None):
+        if level is None:
+            return module.compress(data)
+        return module.compress(data, **{level_kw: level})
+
+    register_codec(name, compress, module.decompress)
+    return CODECS[name]
+
+
+def _batch_executor(workers=None, processes=False):
+    """
+    :return: The pool for batch functions like :func:`save_many`, and its
+        number of workers
+    """
+    import concurrent.futures
+    if workers is None:
+        from .job_tools import probe_node_resources
+        try:
+            workers = probe_node_resources().usable_cpus
+        except (OSError, ValueError, KeyError):
+            # only a hint for sizing the pool; never fail the batch for it
+            workers = os.cpu_count() or 1
+        if not processes:
+            # mostly waiting on the filesystem, so use more threads than CPUs
+            workers = min(32, 4 * workers)
+    if processes:
+        return concurrent.futures.ProcessPoolExecutor(workers), workers
+    return concurrent.futures.ThreadPoolExecutor(workers), workers
+
+
+def _make_executor(threads):
+    """
+    :return: A thread pool with `threads` workers (or None for just one) and
+        the number of workers
+    """
+    if threads is None:
+        threads = min(4, os.cpu_count() or 1)
+    if threads <= 1:
+        return None, 1
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(threads), threads
+
+
+def _open_compressed(f, codec=None, level=None, threads=None):
+    """Wrap the file `f` to compress with `codec`, if it is not None"""
+    if codec is None:
+        return f
+    return _CompressedWriter(f, codec, level, threads)
+
+
+def _open_decompressed(path, threads=None):
+    """Open `path` for reading, decompressing it if it was compressed"""
+    f = open(path, 'rb')
+    if instrumentation.enabled():
+        f = instrumentation.TimedFile(f, 'saving.read')
+    try:
+        if f.peek(len(_CODEC_MAGIC))[:len(_CODEC_MAGIC)] != _CODEC_MAGIC:
+            return f
+        f.read(len(_CODEC_MAGIC))
+        codec = f.read(ord(f.read(1))).decode()
+        return io.BufferedReader(_CompressedReader(f, codec, threads),
+                                 CHUNK_SIZE)
+    except BaseException:
+        f.close()
+        raise
+
+
+class _CompressedWriter(object):
+    """
+    Write-only file that compresses chunks of what is written to `f`
+
+    Chunks are compressed on a thread pool (the stdlib codecs release the
+    GIL), with a bounded number in flight so memory use stays at a few
+    chunks regardless of the size of the pickle.
+    """
+
+    def __init__(self, f, codec, level=None, threads=None):
+        self._compress = _get_codec(codec)[0]
+        self._level = level
+        self._f = f
+        self._buffer = bytearray()
+        self._pool, threads = _make_executor(threads)
+        self._max_pending = 2 * threads
+        self._pending = collections.deque()
+        encoded = codec.encode()
+        f.write(_CODEC_MAGIC + bytes([len(encoded)]) + encoded)
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= CHUNK_SIZE:
+            chunk = bytes(self._buffer[:CHUNK_SIZE])
+            del self._buffer[:CHUNK_SIZE]
+            self._submit(chunk)
+        return len(data)
+
+    def _submit(self, chunk):
+        if self._pool is None:
+            self._write_chunk(self._compress(chunk, self._level))
+            return
+        self._pending.append(self._pool.submit(self._compress, chunk,
+                                               self._level))
+        while len(self._pending) > self._max_pending:
+            self._write_chunk(self._pending.popleft().result())
+
+    def _write_chunk(self, data):
+        self._f.write(_CHUNK_HEADER.pack(len(data)))
+        self._f.write(data)
+
+    def close(self):
+        if self._f.closed:
+            return
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                del self._buffer[:]
+            while self._pending:
+                self._write_chunk(self._pending.popleft().result())
+            self._f.write(_CHUNK_HEADER.pack(0))
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _CompressedReader(io.RawIOBase):
+    """Raw reader that decompresses the chunks in `f`, reading ahead"""
+
+    def __init__(self, f, codec, threads=None):
+        super(_CompressedReader, self).__init__()
+        self._decompress = _get_codec(codec)[1]
+        self._f = f
+        self._pool, threads = _make_executor(threads)
+        self._read_ahead = 2 * threads
+        self._pending = collections.deque()
+        self._chunk = memoryview(b'')
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def _next_raw_chunk(self):
+        if self._eof:
+            return None
+        size = _CHUNK_HEADER.unpack(self._f.read(_CHUNK_HEADER.size))[0]
+        if size == 0:
+            self._eof = True
+            return None
+        return self._f.read(size)
+
+    def _next_chunk(self):
+        if self._pool is None:
+            raw = self._next_raw_chunk()
+            return None if raw is None else self._decompress(raw)
+        while len(self._pending) <= self._read_ahead:
+            raw = self._next_raw_chunk()
+            if raw is None:
+                break
+            self._pending.append(self._pool.submit(self._decompress, raw))
+        return self._pending.popleft().result() if self._pending else None
+
+    def readinto(self, b):
+        while not self._chunk:
+            chunk = self._next_chunk()
+            if chunk is None:
+                return 0
+            self._chunk = memoryview(chunk)
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+        self._f.close()
+        super(_CompressedReader, self).close()
+
+
+def _rebuild_array(typecode, buf):
+    a = array.array(typecode)
+    a.frombytes(buf)
+    return a
+
+
+class _OOBPickler(pickle.Pickler):
+    """Pickler that also sends array.array data through PickleBuffer"""
 
+    def reducer_override(self, obj):
+        if type(obj) is array.array:
+            return _rebuild_array, (obj.typecode, pickle.PickleBuffer(obj))
+        return NotImplemented